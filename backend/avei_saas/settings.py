@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -106,11 +107,48 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # abonnement vérifié sur toutes les vues (pas de liste par vue à tenir à jour)
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
+        'core.permissions.HasActiveSubscription',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttles.AgencyPlanThrottle',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# ---------------------------
+# COMPRESSION DES RÉPONSES
+# ---------------------------
+
+COMPRESSION_MIN_SIZE = 1024       # octets ; en dessous, pas de compression
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4    # rapide, adapté aux réponses dynamiques
+
+# ---------------------------
+# PLANS : DÉBIT ET QUOTAS
+# ---------------------------
+
+# (jetons par seconde, rafale max) par agence
+PLAN_THROTTLE_RATES = {
+    "starter": (5, 20),
+    "pro": (20, 60),
+    "enterprise": (50, 200),
+}
+
+# None = illimité
+PLAN_QUOTAS = {
+    "starter": {"properties": 200, "users": 5},
+    "pro": {"properties": 2000, "users": 25},
+    "enterprise": {"properties": None, "users": None},
 }
 
+AGENCY_POLICY_TTL = 60
+
 # ---------------------------
 # AUTH JWT
 # ---------------------------
@@ -152,3 +190,106 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
 
+THROTTLE_REDIS_URL = os.getenv("THROTTLE_REDIS_URL", REDIS_URL)
+
+# Cache partagé entre workers (versions des matrices de prix, etc.)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+    }
+}
+
+
+CELERY_BEAT_SCHEDULE = {
+    "archive-cold-data": {
+        "task": "core.tasks.archive_cold_data_task",
+        "schedule": timedelta(hours=24),
+        "kwargs": {"max_batches": 200},
+    },
+    "recount-quotas": {
+        "task": "core.tasks.recount_quotas_task",
+        "schedule": timedelta(hours=1),
+    },
+    "refresh-price-stats": {
+        "task": "core.tasks.refresh_price_stats_task",
+        "schedule": timedelta(minutes=5),
+    },
+    "dispatch-webhooks": {
+        "task": "core.tasks.dispatch_webhooks_task",
+        "schedule": timedelta(seconds=15),
+    },
+    "propose-duplicates": {
+        "task": "core.tasks.propose_duplicates_task",
+        "schedule": timedelta(hours=24),
+    },
+}
+
+# ---------------------------
+# ARCHIVAGE (données froides)
+# ---------------------------
+
+ARCHIVE_SOFT_DELETED_DAYS = int(os.getenv("ARCHIVE_SOFT_DELETED_DAYS", "90"))
+# compté depuis la fermeture (Claim.closed_at)
+ARCHIVE_CLOSED_CLAIMS_DAYS = int(os.getenv("ARCHIVE_CLOSED_CLAIMS_DAYS", "365"))
+ARCHIVE_PAST_VISITS_DAYS = int(os.getenv("ARCHIVE_PAST_VISITS_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_BATCH_SLEEP = float(os.getenv("ARCHIVE_BATCH_SLEEP", "0.5"))
+
+# ---------------------------
+# ANALYSE DES PRIX / COMPARABLES
+# ---------------------------
+
+# poids de la distance entre biens (caractéristiques normalisées)
+COMPS_WEIGHTS = {
+    "location": 3.0,
+    "area": 2.0,
+    "rooms": 1.0,
+    "amenities": 0.5,
+}
+
+# taille des cellules géographiques des statistiques (~2 km)
+PRICE_CELL_DEGREES = 0.02
+
+# ---------------------------
+# WEBHOOKS (outbox)
+# ---------------------------
+
+WEBHOOK_BATCH_SIZE = 200          # événements / livraisons par lot
+WEBHOOK_CONNECT_TIMEOUT = 2.0     # secondes
+WEBHOOK_TIMEOUT = 5.0             # secondes (lecture)
+WEBHOOK_POOL_HOSTS = 50
+WEBHOOK_POOL_SIZE = 4
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_BACKOFF_BASE = 30         # secondes, doublé à chaque échec
+WEBHOOK_BACKOFF_MAX = 6 * 3600
+WEBHOOK_PASS_SECONDS = 60         # durée max des envois d'un passage
+# réservation des livraisons d'un passage : toujours plus longue que le
+# passage lui-même (+ un envoi entamé), sinon un passage concurrent les
+# reprendrait et les enverrait une seconde fois
+WEBHOOK_LEASE = WEBHOOK_PASS_SECONDS + WEBHOOK_CONNECT_TIMEOUT + WEBHOOK_TIMEOUT + 30
+WEBHOOK_RETENTION_DAYS = 7
+# http et adresses privées/locales autorisés : développement et tests uniquement
+WEBHOOK_ALLOW_PRIVATE_URLS = False
+
+# ---------------------------
+# ALERTES CLIENTS
+# ---------------------------
+
+ALERT_BUDGET_TOLERANCE = 0.10     # budget client +10 %
+ALERT_ADD_INTEREST = False        # ajouter aussi le bien à interested_properties
+
+# ---------------------------
+# REQUÊTES GROUPÉES (/api/batch/)
+# ---------------------------
+
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 4             # lectures en parallèle (connexions DB)
+
+# ---------------------------
+# DOUBLONS
+# ---------------------------
+
+DEDUPE_CHECK_THRESHOLD = 0.7      # alerte à la création
+DEDUPE_GROUP_THRESHOLD = 0.8      # proposition de fusion (traitement par lots)
+DEDUPE_BLOCK_MAX = 200            # au-delà, la clé n'est pas discriminante
@@ -0,0 +1,179 @@
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AlertNotification, Client, Property
+from .pricing import AMENITIES
+from .versioned import VersionedCache
+
+# ----------------------------------------------------------
+# INDEX INVERSÉ DES CRITÈRES CLIENTS (un par agence, cache processus)
+# ----------------------------------------------------------
+# Client.criteria (JSON libre) est lu avec les clés :
+#   property_type(s) / types, operation_type(s) / operations : str ou liste
+#   amenities : liste (["piscine", ...]) ou dict ({"piscine": true})
+# Client.budget est un prix maximum (tolérance ALERT_BUDGET_TOLERANCE).
+
+ANY = "*"
+
+
+class CriteriaIndex:
+    def __init__(self):
+        self.by_type = defaultdict(set)        # type -> clients ("*" = tous types)
+        self.by_operation = defaultdict(set)
+        self.requires = defaultdict(set)       # équipement -> clients qui l'exigent
+        self.no_budget = set()
+        self.budgets = np.empty(0)             # budgets triés (avec tolérance)
+        self.budget_ids = np.empty(0, dtype=np.int64)
+        self.agents = {}                       # client -> agent assigné
+
+    def match(self, prop):
+        """Ids des clients dont les critères acceptent `prop`."""
+        types = self.by_type.get(prop.property_type, set()) | self.by_type.get(ANY, set())
+        ops = self.by_operation.get(prop.operation_type, set()) | self.by_operation.get(ANY, set())
+        candidates = types & ops if len(types) < len(ops) else ops & types
+        if not candidates:
+            return set()
+
+        start = np.searchsorted(self.budgets, float(prop.price), side="left")
+        affordable = set(self.budget_ids[start:].tolist()) | self.no_budget
+        candidates &= affordable
+
+        for amenity in AMENITIES:
+            if not getattr(prop, amenity) and amenity in self.requires:
+                candidates -= self.requires[amenity]
+        return candidates
+
+
+def _as_set(value):
+    if not value:
+        return set()
+    if isinstance(value, str):
+        return {value}
+    if isinstance(value, dict):
+        return {k for k, v in value.items() if v}
+    return {str(v) for v in value}
+
+
+def parse_criteria(criteria):
+    """criteria JSON -> (types, opérations, équipements exigés)."""
+    criteria = criteria if isinstance(criteria, dict) else {}
+
+    def pick(*keys):
+        for key in keys:
+            if key in criteria:
+                return _as_set(criteria[key])
+        return set()
+
+    types = pick("property_types", "property_type", "types")
+    ops = pick("operation_types", "operation_type", "operations")
+    amenities = pick("amenities") & set(AMENITIES)
+    return types, ops, amenities
+
+
+def _build(agency_id):
+    index = CriteriaIndex()
+    tolerance = 1 + settings.ALERT_BUDGET_TOLERANCE
+    budgets = []
+
+    rows = (
+        Client.objects.filter(agency_id=agency_id, is_deleted=False)
+        .values_list("id", "budget", "criteria", "assigned_agent_id")
+        .iterator(chunk_size=5000)
+    )
+    for client_id, budget, criteria, agent_id in rows:
+        types, ops, amenities = parse_criteria(criteria)
+        for t in types or {ANY}:
+            index.by_type[t].add(client_id)
+        for o in ops or {ANY}:
+            index.by_operation[o].add(client_id)
+        for a in amenities:
+            index.requires[a].add(client_id)
+
+        if budget is None:
+            index.no_budget.add(client_id)
+        else:
+            budgets.append((float(budget) * tolerance, client_id))
+        index.agents[client_id] = agent_id
+
+    budgets.sort()
+    index.budgets = np.array([b for b, _ in budgets], dtype=float)
+    index.budget_ids = np.array([c for _, c in budgets], dtype=np.int64)
+    return index
+
+
+_indexes = VersionedCache("alerts", _build)
+
+
+def invalidate(agency_id):
+    """À appeler après toute écriture d'un client de l'agence."""
+    _indexes.invalidate(agency_id)
+
+
+def criteria_index(agency_id):
+    return _indexes.get(agency_id)
+
+
+# ----------------------------------------------------------
+# FAN-OUT
+# ----------------------------------------------------------
+
+def property_alert_needed(prop, previous=None):
+    """
+    Vrai pour un bien disponible nouveau, ou dont le prix / statut a changé.
+    `previous` : (price, status) avant mise à jour, None à la création.
+    """
+    if prop.is_deleted or prop.status != "disponible":
+        return False
+    return previous is None or previous != (prop.price, prop.status)
+
+
+def fan_out(property_id, reason, add_interest=None):
+    """
+    Notifie les agents des clients correspondant au bien ; retourne le
+    nombre de clients touchés.
+    """
+    prop = Property.objects.filter(pk=property_id, is_deleted=False).first()
+    if prop is None or prop.status != "disponible":
+        return 0
+
+    index = criteria_index(prop.agency_id)
+    client_ids = index.match(prop)
+    if not client_ids:
+        return 0
+
+    now = timezone.now()
+    notifications = [
+        AlertNotification(
+            agency_id=prop.agency_id,
+            agent_id=index.agents.get(client_id),
+            client_id=client_id,
+            property_id=prop.pk,
+            reason=reason,
+            created_at=now,
+        )
+        for client_id in client_ids
+    ]
+    AlertNotification.objects.bulk_create(
+        notifications,
+        batch_size=2000,
+        update_conflicts=True,
+        unique_fields=["client", "property"],
+        update_fields=["reason", "created_at", "read_at", "agent"],
+    )
+
+    if settings.ALERT_ADD_INTEREST if add_interest is None else add_interest:
+        Through = Client.interested_properties.through
+        Through.objects.bulk_create(
+            [Through(client_id=c, property_id=prop.pk) for c in client_ids],
+            batch_size=2000,
+            ignore_conflicts=True,
+        )
+
+    return len(client_ids)
+
+
+def mark_read(queryset):
+    return queryset.filter(read_at__isnull=True).update(read_at=timezone.now())
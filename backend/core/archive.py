@@ -0,0 +1,259 @@
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    Property, Document, Client, Visit, Claim, FinanceEntry, ArchivedRecord,
+    AlertNotification
+)
+
+# ----------------------------------------------------------
+# PARAMÈTRES
+# ----------------------------------------------------------
+
+CLOSED_CLAIM_STATUSES = Claim.CLOSED_STATUSES
+
+# Enfants avant parents : un bien n'est archivé qu'une fois ses
+# documents / visites / finances sortis des tables chaudes.
+ARCHIVE_ORDER = [Document, FinanceEntry, Claim, Visit, Client, Property]
+
+# Lignes dérivées, sans valeur une fois le parent archivé : elles ne
+# bloquent pas l'archivage et partent avec lui (CASCADE).
+DISPOSABLE_CHILDREN = (ArchivedRecord, AlertNotification)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# ----------------------------------------------------------
+# SÉLECTION DES LIGNES FROIDES
+# ----------------------------------------------------------
+
+def cold_rows(model, now=None):
+    """
+    Retourne [(raison, queryset)] des lignes à sortir des tables chaudes.
+    """
+    now = now or timezone.now()
+    soft_limit = now - timedelta(days=_setting("ARCHIVE_SOFT_DELETED_DAYS", 90))
+
+    rules = [
+        ("soft_deleted", model.objects.filter(is_deleted=True, deleted_at__lt=soft_limit)),
+    ]
+
+    if model is Claim:
+        limit = now - timedelta(days=_setting("ARCHIVE_CLOSED_CLAIMS_DAYS", 365))
+        # fermées avant l'ajout de closed_at (ou via update()) : date de création
+        closed_before = Q(closed_at__lt=limit) | Q(closed_at__isnull=True, created_at__lt=limit)
+        rules.append((
+            "closed_claim",
+            Claim.objects.filter(closed_before, status__in=CLOSED_CLAIM_STATUSES),
+        ))
+
+    if model is Visit:
+        limit = now - timedelta(days=_setting("ARCHIVE_PAST_VISITS_DAYS", 365))
+        rules.append(("past_visit", Visit.objects.filter(scheduled_at__lt=limit)))
+
+    return rules
+
+
+def _reverse_fks(model):
+    """Relations FK entrantes (hors M2M) qui empêchent l'archivage d'un parent."""
+    return [
+        rel for rel in model._meta.related_objects
+        if not rel.many_to_many and rel.related_model not in DISPOSABLE_CHILDREN
+    ]
+
+
+def _reverse_m2ms(model):
+    return [rel for rel in model._meta.related_objects if rel.many_to_many]
+
+
+def _blocked_ids(model, ids):
+    """
+    Ids encore référencés par une ligne chaude : on les laisse en place
+    (ils seront repris au prochain passage, une fois les enfants archivés).
+    """
+    blocked = set()
+    for rel in _reverse_fks(model):
+        blocked.update(
+            rel.related_model._base_manager
+            .filter(**{f"{rel.field.name}__in": ids})
+            .values_list(rel.field.attname, flat=True)
+        )
+    return blocked
+
+
+def _agency_id(obj):
+    if hasattr(obj, "agency_id"):
+        return obj.agency_id
+    prop = getattr(obj, "property", None)
+    return prop.agency_id if prop else None
+
+
+def _reverse_m2m_ids(model, ids):
+    """
+    {accessor: {pk: [ids liés]}} pour tout le lot : une requête par
+    relation M2M entrante, sur la table de liaison.
+    """
+    result = {}
+    for rel in _reverse_m2ms(model):
+        through = rel.through
+        source = through._meta.get_field(rel.field.m2m_reverse_field_name()).attname
+        target = through._meta.get_field(rel.field.m2m_field_name()).attname
+        links = {}
+        for pk, related_id in (
+            through._base_manager.filter(**{f"{source}__in": ids})
+            .values_list(source, target).order_by(target)
+        ):
+            links.setdefault(pk, []).append(related_id)
+        result[rel.get_accessor_name()] = links
+    return result
+
+
+def _serialize(obj, reverse_m2m):
+    data = serializers.serialize("python", [obj])[0]
+    reverse = {
+        accessor: links[obj.pk]
+        for accessor, links in reverse_m2m.items()
+        if obj.pk in links
+    }
+    return {"object": data, "reverse_m2m": reverse}
+
+
+# ----------------------------------------------------------
+# ARCHIVAGE
+# ----------------------------------------------------------
+
+def _archive_batch(model, reason, qs, cursor, batch_size):
+    """
+    Déplace un lot dans ArchivedRecord, dans une seule transaction.
+    Retourne (nombre archivé, dernier pk vu) ; dernier pk None = fin.
+    """
+    label = model._meta.label
+    m2m_names = [f.name for f in model._meta.many_to_many]
+    related = ["property"] if not hasattr(model, "agency_id") else []
+
+    with transaction.atomic():
+        batch = list(
+            qs.filter(pk__gt=cursor)
+            .select_related(*related)
+            .prefetch_related(*m2m_names)
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by("pk")[:batch_size]
+        )
+        if not batch:
+            return 0, None
+
+        blocked = _blocked_ids(model, [obj.pk for obj in batch])
+        movable = [obj for obj in batch if obj.pk not in blocked]
+        reverse_m2m = _reverse_m2m_ids(model, [obj.pk for obj in movable])
+
+        ArchivedRecord.objects.bulk_create([
+            ArchivedRecord(
+                model_label=label,
+                object_id=obj.pk,
+                agency_id=_agency_id(obj),
+                reason=reason,
+                payload=_serialize(obj, reverse_m2m),
+            )
+            for obj in movable
+        ])
+        model._base_manager.filter(pk__in=[obj.pk for obj in movable]).delete()
+
+    return len(movable), batch[-1].pk
+
+
+def archive_cold_data(batch_size=None, sleep=None, max_batches=None, models=None, log=None):
+    """
+    Archive les données froides par lots. Chaque lot est atomique : un
+    passage interrompu reprend naturellement au suivant.
+    Retourne {label: nombre archivé}.
+    """
+    batch_size = batch_size or _setting("ARCHIVE_BATCH_SIZE", 500)
+    sleep = _setting("ARCHIVE_BATCH_SLEEP", 0.5) if sleep is None else sleep
+    now = timezone.now()
+
+    stats = {}
+    batches = 0
+
+    for model in models or ARCHIVE_ORDER:
+        label = model._meta.label
+        for reason, qs in cold_rows(model, now):
+            cursor = 0
+            while cursor is not None:
+                if max_batches is not None and batches >= max_batches:
+                    return stats
+
+                moved, cursor = _archive_batch(model, reason, qs, cursor, batch_size)
+                batches += 1
+                if moved:
+                    stats[label] = stats.get(label, 0) + moved
+                    if log:
+                        log(f"{label} ({reason}) : {moved} ligne(s) archivée(s)")
+                if cursor is not None and sleep:
+                    time.sleep(sleep)
+
+    return stats
+
+
+# ----------------------------------------------------------
+# RESTAURATION
+# ----------------------------------------------------------
+
+def _restore_parents(model, fields):
+    """Restaure (ou détache) les parents FK absents des tables chaudes."""
+    for field in model._meta.concrete_fields:
+        if not field.many_to_one or fields.get(field.name) is None:
+            continue
+
+        target = field.related_model
+        pk = fields[field.name]
+        if target._base_manager.filter(pk=pk).exists():
+            continue
+
+        if ArchivedRecord.objects.filter(model_label=target._meta.label, object_id=pk).exists():
+            restore_record(target._meta.label, pk)
+        elif field.null:
+            fields[field.name] = None
+        else:
+            raise ArchivedRecord.DoesNotExist(
+                f"{target._meta.label}#{pk} introuvable pour restaurer {model._meta.label}"
+            )
+
+
+@transaction.atomic
+def restore_record(model_label, object_id):
+    """
+    Remet une ligne archivée dans sa table d'origine (avec ses parents
+    archivés et ses relations M2M encore valides) et retourne l'instance.
+    """
+    record = ArchivedRecord.objects.select_for_update().get(
+        model_label=model_label, object_id=object_id
+    )
+    model = apps.get_model(model_label)
+    data = record.payload["object"]
+
+    _restore_parents(model, data["fields"])
+
+    for item in serializers.deserialize("python", [data]):
+        for name, ids in list(item.m2m_data.items()):
+            target = model._meta.get_field(name).related_model
+            item.m2m_data[name] = list(
+                target._base_manager.filter(pk__in=ids).values_list("pk", flat=True)
+            )
+        item.save()
+        obj = item.object
+
+    for accessor, ids in record.payload.get("reverse_m2m", {}).items():
+        manager = getattr(obj, accessor)
+        manager.add(*manager.model._base_manager.filter(pk__in=ids))
+
+    record.delete()
+    return obj
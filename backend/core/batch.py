@@ -0,0 +1,131 @@
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------
+# REQUÊTES GROUPÉES (/api/batch/)
+# ----------------------------------------------------------
+# Chaque sous-requête est résolue sur core.urls et appelée directement
+# (sans middleware ni nouvelle authentification JWT) : l'utilisateur de
+# la requête englobante est transmis via l'authentification forcée de DRF.
+# Les permissions et filtres de chaque vue s'appliquent ; le débit est
+# décompté une seule fois pour tout le lot (BatchView.throttle_cost).
+
+API_PREFIX = "/api/"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# en-têtes de la requête englobante recopiés dans les sous-requêtes
+FORWARDED_META = (
+    "REMOTE_ADDR", "SERVER_NAME", "SERVER_PORT", "wsgi.url_scheme",
+    "HTTP_HOST", "HTTP_ACCEPT_LANGUAGE", "HTTP_USER_AGENT", "HTTP_X_FORWARDED_FOR",
+)
+
+# en-têtes des sous-réponses renvoyés avec chaque résultat
+RETURNED_HEADERS = ("X-Possible-Duplicates", "Location", "Retry-After")
+
+
+def _sub_request(parent, method, path, body):
+    url = urlsplit(path)
+    payload = b"" if body is None else json.dumps(body).encode()
+
+    sub = HttpRequest()
+    sub.method = method
+    sub.path = sub.path_info = url.path
+    sub.META = {k: parent.META[k] for k in FORWARDED_META if k in parent.META}
+    sub.META.update({
+        "REQUEST_METHOD": method,
+        "PATH_INFO": url.path,
+        "QUERY_STRING": url.query,
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(payload)),
+        "HTTP_ACCEPT": "application/json",
+    })
+    sub.GET = QueryDict(url.query)
+    sub._stream = io.BytesIO(payload)
+    sub._read_started = False
+    sub._dont_enforce_csrf_checks = True
+    sub.batch_item = True  # cf. AgencyPlanThrottle
+
+    # authentification partagée : même instance utilisateur (agence en cache)
+    sub._force_auth_user = parent.user
+    sub._force_auth_token = parent.auth
+    return sub
+
+
+def _response_body(response):
+    if hasattr(response, "data"):
+        return response.data
+    content = b"".join(response.streaming_content) if response.streaming else response.content
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode(errors="replace")
+
+
+def run_item(parent, item, batch_view):
+    """Exécute une sous-requête ; retourne {id, status, headers, body}."""
+    method = item["method"].upper()
+    path = item["path"]
+    result = {"id": item.get("id"), "status": 404, "headers": {}, "body": None}
+
+    if not path.startswith(API_PREFIX):
+        result["body"] = {"detail": f"Chemin hors de {API_PREFIX}"}
+        return result
+
+    try:
+        match = resolve(urlsplit(path).path[len(API_PREFIX) - 1:], urlconf="core.urls")
+    except Resolver404:
+        result["body"] = {"detail": "Introuvable."}
+        return result
+
+    if getattr(match.func, "cls", None) is batch_view:
+        result.update(status=400, body={"detail": "Requêtes groupées imbriquées interdites."})
+        return result
+
+    sub = _sub_request(parent, method, path, item.get("body"))
+    sub.resolver_match = match
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception("Sous-requête en échec : %s %s", method, path)
+        result.update(status=500, body={"detail": "Erreur serveur."})
+        return result
+
+    result.update(
+        status=response.status_code,
+        headers={name: response[name] for name in RETURNED_HEADERS if response.has_header(name)},
+        body=_response_body(response),
+    )
+    return result
+
+
+def _run_in_thread(parent, item, batch_view):
+    close_old_connections()
+    try:
+        return run_item(parent, item, batch_view)
+    finally:
+        connection.close()
+
+
+def run_batch(parent, items, batch_view, concurrent=False):
+    """
+    Exécute les sous-requêtes dans l'ordre. Si `concurrent` et que toutes
+    sont des lectures, elles partent en parallèle (BATCH_MAX_WORKERS).
+    """
+    if concurrent and len(items) > 1 and all(i["method"].upper() in SAFE_METHODS for i in items):
+        workers = min(settings.BATCH_MAX_WORKERS, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda i: _run_in_thread(parent, i, batch_view), items))
+
+    return [run_item(parent, item, batch_view) for item in items]
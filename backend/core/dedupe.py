@@ -0,0 +1,291 @@
+from difflib import SequenceMatcher
+from itertools import combinations, groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Client, DuplicateGroup, Owner, Property
+from .normalize import address_key, fold, normalize_name, person_keys
+
+# ----------------------------------------------------------
+# DÉTECTION DES DOUBLONS
+# ----------------------------------------------------------
+# Les comparaisons floues ne se font qu'à l'intérieur d'un bloc (mêmes
+# agence + clé normalisée), jamais sur toute la table.
+
+PEOPLE = (Owner, Client)
+
+KEY_FIELDS = {
+    Owner: ("phone_key", "email_key", "name_key"),
+    Client: ("phone_key", "email_key", "name_key"),
+    Property: ("address_key",),
+}
+
+SCORING_FIELDS = {
+    Owner: ("name", "phone_key", "email_key"),
+    Client: ("name", "phone_key", "email_key"),
+    Property: ("title", "address", "property_type", "operation_type", "area"),
+}
+
+
+def _ratio(a, b, weight, bonus, floor):
+    """
+    bonus + weight * similarité(a, b), ou 0 si le plafond de similarité
+    (real_quick_ratio / quick_ratio, bien moins coûteux) ne permet pas
+    d'atteindre `floor`.
+    """
+    if not a or not b:
+        return bonus
+    matcher = SequenceMatcher(None, a, b)
+    for bound in (matcher.real_quick_ratio, matcher.quick_ratio, matcher.ratio):
+        score = bonus + weight * bound()
+        if score < floor:
+            return 0.0
+    return score
+
+
+def prepare(model, row):
+    """Valeurs brutes (SCORING_FIELDS) -> tuple normalisé une seule fois."""
+    if model in PEOPLE:
+        return normalize_name(row[0]), row[1], row[2]
+    title, address, ptype, op, area = row
+    return fold(title), fold(address), ptype, op, area
+
+
+def score_people(a, b, floor=0.0):
+    """
+    a, b : (nom normalisé, phone_key, email_key).
+    Contact commun : fort indice. Contacts contradictoires : le nom seul
+    ne suffit pas. Rien à comparer : le nom décide.
+    """
+    same = [x == y for x, y in zip(a[1:], b[1:]) if x and y]
+    if any(same):
+        bonus, weight = 0.45 * sum(same), 0.55
+    elif same:
+        bonus, weight = 0.0, 0.55
+    else:
+        bonus, weight = 0.0, 0.9
+    if bonus + weight < floor:
+        return 0.0
+    return min(_ratio(a[0], b[0], weight, bonus, floor), 1.0)
+
+
+def score_properties(a, b, floor=0.0):
+    """a, b : (titre, adresse, type, opération, surface) normalisés."""
+    bonus = 0.0
+    if a[2] == b[2] and a[3] == b[3]:
+        bonus += 0.15
+    if a[4] and b[4]:
+        if abs(a[4] - b[4]) <= 0.05 * max(a[4], b[4]):
+            bonus += 0.15
+    elif not a[4] and not b[4]:
+        bonus += 0.15
+
+    score = _ratio(a[1], b[1], 0.5, bonus, floor - 0.2)
+    if not score:
+        return 0.0
+    return _ratio(a[0], b[0], 0.2, score, floor)
+
+
+def _scorer(model):
+    return score_people if model in PEOPLE else score_properties
+
+
+# ----------------------------------------------------------
+# VÉRIFICATION À LA CRÉATION
+# ----------------------------------------------------------
+
+def possible_duplicates(model, agency_id, data, exclude_id=None, queryset=None):
+    """
+    Fiches existantes proches de `data` (valeurs du formulaire) : une
+    seule requête sur les colonnes de clés indexées, puis score flou.
+    `queryset` restreint les candidats (périmètre visible par l'appelant).
+    Retourne [(id, score)] trié par score décroissant.
+    """
+    if model in PEOPLE:
+        keys = dict(zip(KEY_FIELDS[model], person_keys(data.get("name"), data.get("email"), data.get("phone"))))
+        probe = prepare(model, (data.get("name"), keys["phone_key"], keys["email_key"]))
+    else:
+        keys = {"address_key": address_key(data.get("address"))}
+        try:
+            area = float(data.get("area") or 0) or None
+        except (TypeError, ValueError):
+            area = None
+        probe = prepare(model, (data.get("title"), data.get("address"),
+                                data.get("property_type"), data.get("operation_type"), area))
+
+    lookup = Q()
+    for field, value in keys.items():
+        if value:
+            lookup |= Q(**{field: value})
+    if not lookup:
+        return []
+
+    base = model.objects.all() if queryset is None else queryset
+    candidates = (
+        base.filter(lookup, agency_id=agency_id, is_deleted=False)
+        .exclude(pk=exclude_id)
+        .values_list("id", *SCORING_FIELDS[model])[:settings.DEDUPE_BLOCK_MAX]
+    )
+
+    scorer = _scorer(model)
+    threshold = settings.DEDUPE_CHECK_THRESHOLD
+    scored = [(row[0], scorer(probe, prepare(model, row[1:]), threshold)) for row in candidates]
+    return sorted(((pk, round(s, 3)) for pk, s in scored if s >= threshold), key=lambda x: -x[1])
+
+
+# ----------------------------------------------------------
+# TRAITEMENT PAR LOTS
+# ----------------------------------------------------------
+
+def _keys(model, row):
+    """Valeurs sources -> clés attendues (même calcul que Model.save())."""
+    if model in PEOPLE:
+        return person_keys(*row)
+    return (address_key(row[0]),)
+
+
+def backfill_keys(model, chunk_size=2000):
+    """
+    Recalcule les clés des lignes écrites sans save() complet (imports,
+    bulk_create, QuerySet.update()...). Toutes les lignes sont relues par
+    tranches de pk, mais seules celles dont une clé diffère sont écrites :
+    une clé légitimement vide (nom court, pas de téléphone) n'est pas
+    réécrite à chaque passage. Retourne le nombre de lignes corrigées.
+    """
+    sources = ("name", "email", "phone") if model in PEOPLE else ("address",)
+    fields = list(KEY_FIELDS[model])
+
+    fixed = 0
+    last = 0
+    while True:
+        rows = list(
+            model.objects.filter(pk__gt=last).order_by("pk")
+            .values_list("pk", *fields, *sources)[:chunk_size]
+        )
+        if not rows:
+            return fixed
+        last = rows[-1][0]
+
+        stale = [
+            row[0]
+            for row in rows
+            if _keys(model, row[1 + len(fields):]) != tuple(row[1:1 + len(fields)])
+        ]
+        if not stale:
+            continue
+
+        # UPDATE seul : une ligne supprimée entre-temps n'est pas recréée
+        batch = list(model.objects.filter(pk__in=stale).only(*fields, *sources))
+        for obj in batch:
+            keys = _keys(model, [getattr(obj, source) for source in sources])
+            for field, value in zip(fields, keys):
+                setattr(obj, field, value)
+        model.objects.bulk_update(batch, fields, batch_size=500)
+        fixed += len(batch)
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = self.parent.setdefault(x, x)
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while x != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def find_groups(model, agency_id=None):
+    """
+    Parcourt chaque colonne de clé triée (index agence + clé) en flux et
+    compare les fiches deux à deux à l'intérieur de chaque bloc.
+    Retourne [(agency_id, [ids], score max)].
+    """
+    scorer = _scorer(model)
+    threshold = settings.DEDUPE_GROUP_THRESHOLD
+    block_max = settings.DEDUPE_BLOCK_MAX
+
+    uf = _UnionFind()
+    agencies = {}
+    best = {}
+
+    for key_field in KEY_FIELDS[model]:
+        qs = model.objects.filter(is_deleted=False).exclude(**{key_field: ""})
+        if agency_id:
+            qs = qs.filter(agency_id=agency_id)
+        rows = (
+            qs.order_by("agency_id", key_field)
+            .values_list("agency_id", key_field, "id", *SCORING_FIELDS[model])
+            .iterator(chunk_size=10000)
+        )
+
+        for (agency, _), block in groupby(rows, key=lambda r: (r[0], r[1])):
+            block = list(block)
+            # bloc trop large = clé non discriminante (nom très courant...)
+            if len(block) < 2 or len(block) > block_max:
+                continue
+            block = [(row[2], prepare(model, row[3:])) for row in block]
+            for (id_a, a), (id_b, b) in combinations(block, 2):
+                score = scorer(a, b, threshold)
+                if score >= threshold:
+                    uf.union(id_a, id_b)
+                    agencies[id_a] = agencies[id_b] = agency
+                    pair = (min(id_a, id_b), max(id_a, id_b))
+                    best[pair] = max(best.get(pair, 0.0), score)
+
+    groups = {}
+    for pk in agencies:
+        groups.setdefault(uf.find(pk), []).append(pk)
+
+    scores = {}
+    for (a, _), score in best.items():
+        root = uf.find(a)
+        scores[root] = max(scores.get(root, 0.0), score)
+
+    return [
+        (agencies[root], sorted(members), round(scores[root], 3))
+        for root, members in groups.items()
+    ]
+
+
+def propose_merge_groups(models=None, agency_id=None):
+    """
+    Remplace les propositions en cours par celles du dernier passage.
+    Les groupes déjà écartés (dismissed) ne sont pas reproposés.
+    Retourne {label: nombre de groupes}.
+    """
+    stats = {}
+    for model in models or (Owner, Client, Property):
+        label = model._meta.label
+        backfill_keys(model)
+        found = find_groups(model, agency_id)
+
+        existing = DuplicateGroup.objects.filter(model_label=label)
+        if agency_id:
+            existing = existing.filter(agency_id=agency_id)
+        dismissed = {
+            (agency, tuple(ids))
+            for agency, ids in existing.filter(status="dismissed").values_list("agency_id", "member_ids")
+        }
+
+        with transaction.atomic():
+            existing.filter(status="proposed").delete()
+            DuplicateGroup.objects.bulk_create(
+                [
+                    DuplicateGroup(agency_id=agency, model_label=label, member_ids=ids, score=score)
+                    for agency, ids, score in found
+                    if (agency, tuple(ids)) not in dismissed
+                ],
+                batch_size=2000,
+            )
+        stats[label] = len(found)
+    return stats
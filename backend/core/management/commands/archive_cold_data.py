@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.archive import ARCHIVE_ORDER, archive_cold_data, cold_rows, restore_record
+from core.models import ArchivedRecord
+
+
+class Command(BaseCommand):
+    help = "Déplace les lignes froides (soft-delete anciens, réclamations closes, visites passées) vers les archives."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--sleep", type=float, default=None, help="Pause (s) entre deux lots.")
+        parser.add_argument("--max-batches", type=int, default=None)
+        parser.add_argument("--dry-run", action="store_true", help="Compte les candidats sans rien déplacer.")
+        parser.add_argument(
+            "--restore", nargs="+", metavar="LABEL:ID",
+            help="Restaure des lignes archivées, ex. core.Property:42",
+        )
+
+    def handle(self, *args, **options):
+        if options["restore"]:
+            return self.restore(options["restore"])
+
+        if options["dry_run"]:
+            for model in ARCHIVE_ORDER:
+                for reason, qs in cold_rows(model):
+                    self.stdout.write(f"{model._meta.label} ({reason}) : {qs.count()} candidat(s)")
+            return
+
+        stats = archive_cold_data(
+            batch_size=options["batch_size"],
+            sleep=options["sleep"],
+            max_batches=options["max_batches"],
+            log=self.stdout.write,
+        )
+        total = sum(stats.values())
+        self.stdout.write(self.style.SUCCESS(f"{total} ligne(s) archivée(s)"))
+
+    def restore(self, targets):
+        for target in targets:
+            try:
+                label, object_id = target.split(":")
+                obj = restore_record(label, int(object_id))
+            except ValueError:
+                raise CommandError(f"Format attendu LABEL:ID, reçu « {target} »")
+            except (LookupError, ArchivedRecord.DoesNotExist) as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(self.style.SUCCESS(f"Restauré : {label}#{obj.pk}"))
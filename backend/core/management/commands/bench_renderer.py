@@ -0,0 +1,81 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from core.middleware import brotli, compress
+from core.models import OPERATION_CHOICES, PROPERTY_STATUS_CHOICES, PROPERTY_TYPE_CHOICES
+from core.renderers import FastJSONRenderer, orjson
+
+
+def sample_rows(count, seed=0):
+    """Lignes au format d'une liste de biens / finances (Decimal et datetime bruts)."""
+    rnd = random.Random(seed)
+    now = timezone.now()
+    return [
+        {
+            "id": i,
+            "agency": 1,
+            "title": f"Appartement {rnd.randint(2, 6)} pièces, quartier {rnd.choice('ABCDEFG')}",
+            "description": "Bel appartement lumineux proche commodités. " * rnd.randint(1, 4),
+            "property_type": rnd.choice(PROPERTY_TYPE_CHOICES)[0],
+            "operation_type": rnd.choice(OPERATION_CHOICES)[0],
+            "status": rnd.choice(PROPERTY_STATUS_CHOICES)[0],
+            "address": f"{rnd.randint(1, 200)} boulevard Anfa, Casablanca",
+            "latitude": Decimal(f"33.{rnd.randint(500000, 620000)}"),
+            "longitude": Decimal(f"-7.{rnd.randint(550000, 680000)}"),
+            "price": Decimal(rnd.randint(300000, 9000000)) / 100,
+            "amount": Decimal(rnd.randint(1000, 500000)) / 100,
+            "area": round(rnd.uniform(30, 400), 1),
+            "chambres": rnd.randint(0, 6),
+            "meuble": rnd.random() < 0.5,
+            "piscine": rnd.random() < 0.1,
+            "parking": rnd.random() < 0.4,
+            "agents": [rnd.randint(1, 20) for _ in range(rnd.randint(0, 3))],
+            "created_at": now - timedelta(minutes=i),
+        }
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Mesure le rendu JSON (lignes/s) et la taille transférée (brut, gzip, br)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = sample_rows(options["rows"])
+        repeat = options["repeat"]
+
+        renderers = [("drf-json", JSONRenderer())]
+        if orjson is not None:
+            renderers.append(("fast-json", FastJSONRenderer()))
+        else:
+            self.stdout.write(self.style.WARNING("orjson absent : seul le rendu DRF est mesuré."))
+
+        body = b""
+        for name, renderer in renderers:
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                body = renderer.render(rows)
+                best = min(best, time.perf_counter() - start)
+            self.stdout.write(
+                f"{name:10} {len(rows) / best:>12,.0f} lignes/s   {len(body):>10,} octets"
+            )
+
+        encodings = ["gzip"] + (["br"] if brotli is not None else [])
+        for encoding in encodings:
+            start = time.perf_counter()
+            compressed = compress(body, encoding)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{encoding:10} {len(compressed):>10,} octets sur le réseau "
+                f"({len(compressed) / len(body):.1%}, {elapsed * 1000:.1f} ms)"
+            )
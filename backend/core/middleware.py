@@ -0,0 +1,151 @@
+import gzip
+import re
+import zlib
+from itertools import chain
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # dépendance optionnelle : gzip uniquement
+    brotli = None
+
+# ----------------------------------------------------------
+# COMPRESSION NÉGOCIÉE (br / gzip)
+# ----------------------------------------------------------
+
+# JSON uniquement : les pages HTML (API navigable, admin) contiennent le
+# jeton CSRF et seraient exposées à BREACH sans le bourrage de GZipMiddleware
+COMPRESSIBLE_TYPES = ("application/json",)
+
+_token_re = re.compile(r"\s*([a-z0-9*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*")
+
+
+def parse_accept_encoding(header):
+    """`Accept-Encoding` -> {codage: q}."""
+    accepted = {}
+    for part in header.lower().split(","):
+        match = _token_re.fullmatch(part)
+        if not match:
+            continue
+        try:
+            accepted[match[1]] = float(match[2]) if match[2] else 1.0
+        except ValueError:
+            continue
+    return accepted
+
+
+def choose_encoding(header):
+    """Meilleur codage supporté, en préférant br à q égal ; None sinon."""
+    accepted = parse_accept_encoding(header or "")
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self.obj = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            # wbits 16+ : en-tête et pied gzip
+            self.obj = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self.obj.process(data)
+        return self.obj.compress(data)
+
+    def flush(self):
+        if self.encoding == "br":
+            return self.obj.finish()
+        return self.obj.flush()
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def peek_stream(chunks, min_size):
+    """
+    Lit le début d'un flux jusqu'à `min_size` octets. Retourne (début lu,
+    taille, itérateur du reste) ; taille < min_size = flux épuisé.
+    """
+    chunks = iter(chunks)
+    head, size = [], 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            break
+    return head, size, chunks
+
+
+def compress_stream(chunks, encoding):
+    compressor = _Compressor(encoding)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+class CompressionMiddleware:
+    """
+    Compresse les réponses (br si disponible, sinon gzip) selon
+    Accept-Encoding. Les réponses sous COMPRESSION_MIN_SIZE octets ne sont
+    pas compressées ; pour les réponses en flux, le début est lu jusqu'à ce
+    seuil avant de décider, puis le reste est compressé au fil de l'eau.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        if response.has_header("Content-Encoding") or response.status_code == 206:
+            return response
+
+        content_type = response.get("Content-Type", "")
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING"))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                return response
+            head, size, rest = peek_stream(response.streaming_content, settings.COMPRESSION_MIN_SIZE)
+            if size < settings.COMPRESSION_MIN_SIZE:
+                response.streaming_content = head
+                return response
+            response.streaming_content = compress_stream(chain(head, rest), encoding)
+            del response["Content-Length"]
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
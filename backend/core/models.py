@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 
+from .normalize import address_key, person_keys, price_cell
+
 # -----------------------------
 # CHOICES
 # -----------------------------
@@ -55,6 +59,20 @@ PROPERTY_STATUS_CHOICES = [
 # MODELS
 # -----------------------------
 
+def with_derived_fields(update_fields, derived):
+    """
+    save(update_fields=...) : ajoute les colonnes calculées dont une
+    source est mise à jour. `derived` : {colonne: (sources, ...)}.
+    """
+    if update_fields is None:
+        return None
+    update_fields = set(update_fields)
+    for field, sources in derived.items():
+        if update_fields.intersection(sources):
+            update_fields.add(field)
+    return update_fields
+
+
 class Agency(models.Model):
     name = models.CharField(max_length=255)
     address = models.TextField(blank=True, null=True)
@@ -62,6 +80,10 @@ class Agency(models.Model):
     subscription_expires = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # compteurs de quotas (cf. core.quotas)
+    property_count = models.PositiveIntegerField(default=0, editable=False)
+    user_count = models.PositiveIntegerField(default=0, editable=False)
+
     def __str__(self):
         return self.name
 
@@ -90,13 +112,44 @@ class SoftDeleteModel(models.Model):
         self.save()
 
 
-class Owner(SoftDeleteModel):
+class PersonKeysModel(models.Model):
+    """
+    Clés de blocage normalisées (cf. core.normalize), recalculées à chaque
+    save() et indexées avec l'agence pour la détection des doublons.
+    """
+    DERIVED_FIELDS = {
+        "phone_key": ("phone",),
+        "email_key": ("email",),
+        "name_key": ("name",),
+    }
+
+    phone_key = models.CharField(max_length=20, blank=True, default="", editable=False)
+    email_key = models.CharField(max_length=254, blank=True, default="", editable=False)
+    name_key = models.CharField(max_length=64, blank=True, default="", editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.phone_key, self.email_key, self.name_key = person_keys(self.name, self.email, self.phone)
+        kwargs["update_fields"] = with_derived_fields(kwargs.get("update_fields"), self.DERIVED_FIELDS)
+        super().save(*args, **kwargs)
+
+
+class Owner(PersonKeysModel, SoftDeleteModel):
     name = models.CharField(max_length=255)
     email = models.EmailField(blank=True, null=True)
     phone = models.CharField(max_length=50, blank=True, null=True)
     id_document = models.FileField(upload_to="owners/docs/", null=True, blank=True)
     agency = models.ForeignKey(Agency, on_delete=models.CASCADE, related_name="owners")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["agency", "phone_key"]),
+            models.Index(fields=["agency", "email_key"]),
+            models.Index(fields=["agency", "name_key"]),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -138,6 +191,28 @@ class Property(SoftDeleteModel):
     created_by = models.ForeignKey("core.User", null=True, blank=True, on_delete=models.SET_NULL, related_name="created_properties")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # clé de blocage des doublons (cf. core.normalize)
+    address_key = models.CharField(max_length=128, blank=True, default="", editable=False)
+    # cellule des statistiques de prix (cf. core.pricing), "" = sans coordonnées
+    price_cell = models.CharField(max_length=32, blank=True, default="", editable=False)
+
+    DERIVED_FIELDS = {
+        "address_key": ("address",),
+        "price_cell": ("latitude", "longitude"),
+    }
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["agency", "property_type", "operation_type", "price_cell"]),
+            models.Index(fields=["agency", "address_key"]),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.address_key = address_key(self.address)
+        self.price_cell = price_cell(self.latitude, self.longitude, settings.PRICE_CELL_DEGREES)
+        kwargs["update_fields"] = with_derived_fields(kwargs.get("update_fields"), self.DERIVED_FIELDS)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.title} - {self.address}"
 
@@ -161,7 +236,7 @@ class Document(SoftDeleteModel):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
-class Client(SoftDeleteModel):
+class Client(PersonKeysModel, SoftDeleteModel):
     agency = models.ForeignKey(Agency, on_delete=models.CASCADE, related_name="clients")
 
     name = models.CharField(max_length=255)
@@ -176,10 +251,17 @@ class Client(SoftDeleteModel):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["agency", "phone_key"]),
+            models.Index(fields=["agency", "email_key"]),
+            models.Index(fields=["agency", "name_key"]),
+        ]
+
 
 class Visit(SoftDeleteModel):
     property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name="visits")
-    client = models.ForeignForeignKey(Client, on_delete=models.CASCADE, related_name="visits")
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name="visits")
     agent = models.ForeignKey("core.User", on_delete=models.SET_NULL, null=True, related_name="visits")
 
     scheduled_at = models.DateTimeField()
@@ -195,11 +277,27 @@ class Claim(SoftDeleteModel):
     client = models.ForeignKey(Client, null=True, blank=True, on_delete=models.SET_NULL)
     agent = models.ForeignKey("core.User", null=True, blank=True, on_delete=models.SET_NULL, related_name="claims")
 
+    CLOSED_STATUSES = ("closed", "resolved")
+
     description = models.TextField()
     status = models.CharField(max_length=32, default="open")
     reminder_sent = models.BooleanField(default=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # date de passage à un statut fermé (vidée à la réouverture)
+    closed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    DERIVED_FIELDS = {
+        "closed_at": ("status",),
+    }
+
+    def save(self, *args, **kwargs):
+        if self.status not in self.CLOSED_STATUSES:
+            self.closed_at = None
+        elif self.closed_at is None:
+            self.closed_at = timezone.now()
+        kwargs["update_fields"] = with_derived_fields(kwargs.get("update_fields"), self.DERIVED_FIELDS)
+        super().save(*args, **kwargs)
 
 
 class FinanceEntry(SoftDeleteModel):
@@ -220,3 +318,157 @@ class FinanceEntry(SoftDeleteModel):
 
     created_by = models.ForeignKey("core.User", null=True, blank=True, on_delete=models.SET_NULL, related_name="created_finances")
     created_at = models.DateTimeField(auto_now_add=True)
+
+
+# -----------------------------
+# ALERTES (recherches enregistrées)
+# -----------------------------
+
+class AlertNotification(models.Model):
+    """
+    Un bien correspond aux critères d'un client : notification pour
+    l'agent assigné. Une seule ligne par (client, bien), remise à
+    « non lue » à chaque nouvelle correspondance.
+    """
+    REASONS = [
+        ("new", "Nouveau bien"),
+        ("changed", "Prix ou statut modifié"),
+    ]
+
+    agency = models.ForeignKey(Agency, on_delete=models.CASCADE, related_name="alerts")
+    agent = models.ForeignKey("core.User", null=True, blank=True, on_delete=models.SET_NULL, related_name="alerts")
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name="alerts")
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name="alerts")
+
+    reason = models.CharField(max_length=16, choices=REASONS)
+    created_at = models.DateTimeField(default=timezone.now)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("client", "property")
+        indexes = [models.Index(fields=["agent", "read_at"])]
+
+
+# -----------------------------
+# STATISTIQUES DE PRIX
+# -----------------------------
+
+class PriceStat(models.Model):
+    """
+    Percentiles du prix au m² par agence, type, opération et cellule
+    géographique. Recalculé par groupe quand `dirty` (cf. core.pricing).
+    """
+    agency = models.ForeignKey(Agency, on_delete=models.CASCADE, related_name="price_stats")
+    property_type = models.CharField(max_length=32, choices=PROPERTY_TYPE_CHOICES)
+    operation_type = models.CharField(max_length=32, choices=OPERATION_CHOICES)
+    cell = models.CharField(max_length=32, blank=True)   # "" = sans coordonnées
+
+    count = models.PositiveIntegerField(default=0)
+    p10 = models.FloatField(null=True, blank=True)
+    p25 = models.FloatField(null=True, blank=True)
+    p50 = models.FloatField(null=True, blank=True)
+    p75 = models.FloatField(null=True, blank=True)
+    p90 = models.FloatField(null=True, blank=True)
+
+    dirty = models.BooleanField(default=True, db_index=True)
+    marked_at = models.DateTimeField(null=True, blank=True)   # dernier marquage dirty
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("agency", "property_type", "operation_type", "cell")
+
+
+# -----------------------------
+# WEBHOOKS / OUTBOX
+# -----------------------------
+
+class WebhookEndpoint(models.Model):
+    agency = models.ForeignKey(Agency, on_delete=models.CASCADE, related_name="webhooks")
+    url = models.URLField(max_length=512)
+    secret = models.CharField(max_length=128, blank=True)
+    events = models.JSONField(default=list, blank=True)   # [] = tous les événements
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.url
+
+
+class OutboxEvent(models.Model):
+    """
+    Événement métier écrit dans la même transaction que la donnée.
+    Supprimé dès qu'il a été réparti en livraisons (cf. core.webhooks).
+    """
+    agency = models.ForeignKey(Agency, on_delete=models.CASCADE, related_name="outbox_events")
+    event_type = models.CharField(max_length=64)
+    model_label = models.CharField(max_length=64)
+    object_id = models.BigIntegerField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class WebhookDelivery(models.Model):
+    STATUS = [
+        ("pending", "Pending"),
+        ("delivered", "Delivered"),
+        ("failed", "Failed"),
+    ]
+
+    endpoint = models.ForeignKey(WebhookEndpoint, on_delete=models.CASCADE, related_name="deliveries")
+    events = models.JSONField(encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=16, choices=STATUS, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+
+# -----------------------------
+# DOUBLONS
+# -----------------------------
+
+class DuplicateGroup(models.Model):
+    """Groupe de fiches probablement identiques, proposé à la fusion."""
+    STATUS = [
+        ("proposed", "Proposed"),
+        ("dismissed", "Dismissed"),
+    ]
+
+    agency = models.ForeignKey(Agency, on_delete=models.CASCADE, related_name="duplicate_groups")
+    model_label = models.CharField(max_length=64)
+    member_ids = models.JSONField()
+    score = models.FloatField()
+    status = models.CharField(max_length=16, choices=STATUS, default="proposed")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["agency", "model_label", "status"])]
+
+
+# -----------------------------
+# ARCHIVES (données froides)
+# -----------------------------
+
+class ArchivedRecord(models.Model):
+    """
+    Ligne sortie des tables chaudes (soft-delete ancien, réclamation close,
+    visite passée). Le contenu est sérialisé pour pouvoir être restauré.
+    """
+    model_label = models.CharField(max_length=64)
+    object_id = models.BigIntegerField()
+    agency_id = models.BigIntegerField(null=True, blank=True, db_index=True)
+
+    reason = models.CharField(max_length=32)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("model_label", "object_id")
+        indexes = [models.Index(fields=["archived_at"])]
+
+    def __str__(self):
+        return f"{self.model_label}#{self.object_id}"
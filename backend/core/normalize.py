@@ -0,0 +1,90 @@
+import math
+import re
+import unicodedata
+from decimal import Decimal
+
+# ----------------------------------------------------------
+# NORMALISATION -> CLÉS INDEXÉES
+# ----------------------------------------------------------
+# Fonctions pures, sans accès à la base : utilisées par Model.save()
+# pour remplir les colonnes indexées *_key (core.dedupe) et la cellule
+# géographique des statistiques de prix (core.pricing).
+
+NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+# mots trop fréquents pour distinguer deux adresses
+ADDRESS_STOPWORDS = {
+    "rue", "avenue", "av", "bd", "boulevard", "bld", "place", "pl", "route", "rte",
+    "quartier", "qt", "hay", "residence", "res", "immeuble", "imm", "appt",
+    "appartement", "etage", "n", "no", "num", "de", "du", "des", "la", "le",
+    "les", "el", "al", "d", "l", "et",
+}
+
+
+def fold(text):
+    """Minuscules, sans accents ni ponctuation, espaces uniques."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join(NON_ALNUM.sub(" ", text).split())
+
+
+def normalize_phone(phone):
+    """
+    Chiffres seuls, indicatif retiré : +212 6 12-34-56-78, 0612345678 et
+    00212612345678 donnent tous « 612345678 » (9 derniers chiffres).
+    """
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) < 6:
+        return ""
+    return digits[-9:]
+
+
+def normalize_email(email):
+    """Minuscules, étiquette « +tag » retirée de la partie locale."""
+    email = (email or "").strip().lower()
+    if "@" not in email:
+        return ""
+    local, _, domain = email.partition("@")
+    return f"{local.split('+', 1)[0]}@{domain}"
+
+
+def normalize_name(name):
+    """Jetons triés : « EL AMRANI Mohamed » == « Mohamed El-Amrani »."""
+    return " ".join(sorted(fold(name).split()))
+
+
+def name_key(name):
+    """
+    Clé de blocage : préfixes (4 lettres) des deux jetons significatifs
+    triés. Tolère les variantes d'orthographe en fin de mot.
+    """
+    tokens = sorted(t for t in fold(name).split() if len(t) >= 3)
+    return "|".join(t[:4] for t in tokens[:2])
+
+
+def address_key(address):
+    """Numéros + trois premiers mots significatifs (3 lettres), triés."""
+    tokens = [t for t in fold(address).split() if t not in ADDRESS_STOPWORDS]
+    numbers = sorted(t for t in tokens if t.isdigit())
+    words = sorted(t[:3] for t in tokens if not t.isdigit())[:3]
+    return " ".join(numbers + words)[:128]
+
+
+def person_keys(name, email, phone):
+    return normalize_phone(phone), normalize_email(email)[:254], name_key(name)[:64]
+
+
+def price_cell(latitude, longitude, size):
+    """
+    Cellule « i:j » de la grille de `size` degrés ; "" sans coordonnées.
+    Calcul décimal exact : même résultat que les valeurs stockées
+    (DecimalField), sans arrondi flottant aux bords des cellules.
+    """
+    if latitude is None or longitude is None:
+        return ""
+    size = Decimal(str(size))
+    i = math.floor(Decimal(str(latitude)) / size)
+    j = math.floor(Decimal(str(longitude)) / size)
+    return f"{i}:{j}"
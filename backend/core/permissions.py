@@ -1,5 +1,8 @@
+from django.utils import timezone
 from rest_framework import permissions
 
+from .throttles import agency_policy
+
 # -------------------------------------------------------
 # PERMISSION : SUPER ADMIN
 # -------------------------------------------------------
@@ -12,6 +15,19 @@ class IsSuperAdmin(permissions.BasePermission):
         )
 
 
+class IsSuperAdminOrReadOnly(permissions.BasePermission):
+    """
+    Lecture pour tout utilisateur connecté, écriture réservée au super admin.
+    """
+    def has_permission(self, request, view):
+        if request.method in permissions.SAFE_METHODS:
+            return request.user.is_authenticated
+        return (
+            request.user.is_authenticated and
+            request.user.role == "superadmin"
+        )
+
+
 # -------------------------------------------------------
 # PERMISSION : DIRECTEUR D’AGENCE
 # -------------------------------------------------------
@@ -73,3 +89,23 @@ class CanViewFinance(permissions.BasePermission):
             return obj.agent == user
 
         return False
+
+
+# -------------------------------------------------------
+# PERMISSION : ABONNEMENT ACTIF
+# -------------------------------------------------------
+
+class HasActiveSubscription(permissions.BasePermission):
+    """
+    Refuse l’accès si l’abonnement de l’agence a expiré.
+    Lecture du plan en cache : pas de requête SQL par appel.
+    """
+    message = "L’abonnement de votre agence a expiré."
+
+    def has_permission(self, request, view):
+        agency_id = getattr(request.user, "agency_id", None)
+        if not agency_id:
+            return True
+
+        _, expires = agency_policy(agency_id)
+        return expires is None or expires >= timezone.localdate()
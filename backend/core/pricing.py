@@ -0,0 +1,271 @@
+import math
+import warnings
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Property, PriceStat
+from .normalize import price_cell
+from .versioned import VersionedCache
+
+# ----------------------------------------------------------
+# MATRICE DE CARACTÉRISTIQUES (une par agence, cache processus)
+# ----------------------------------------------------------
+
+AMENITIES = [
+    "meuble", "ascenseur", "balcon", "terrasse",
+    "climatisation", "piscine", "parking",
+]
+NUMERIC = ["latitude", "longitude", "area", "chambres", "salles_bain"]
+FEATURES = NUMERIC + AMENITIES
+
+KM_PER_DEGREE = 111.32
+
+FeatureMatrix = namedtuple(
+    "FeatureMatrix",
+    "ids property_types operation_types matrix medians scales lon_factor weights",
+)
+
+def _weights():
+    w = settings.COMPS_WEIGHTS
+    return np.array(
+        [w["location"], w["location"], w["area"], w["rooms"], w["rooms"]]
+        + [w["amenities"] / len(AMENITIES)] * len(AMENITIES)
+    )
+
+
+def _raw(rows, lon_factor):
+    """Lignes (valeurs de FEATURES) -> tableau brut, lat/lon en km."""
+    raw = np.array(
+        [[np.nan if v is None else float(v) for v in row] for row in rows],
+        dtype=float,
+    ).reshape(len(rows), len(FEATURES))
+    raw[:, 0] *= KM_PER_DEGREE
+    raw[:, 1] *= KM_PER_DEGREE * lon_factor
+    return raw
+
+
+def _rows(agency_id, ids=None):
+    qs = Property.objects.filter(agency_id=agency_id, is_deleted=False)
+    if ids is not None:
+        qs = qs.filter(pk__in=ids)
+    return list(qs.values_list("id", "property_type", "operation_type", *FEATURES))
+
+
+def _build(agency_id):
+    rows = _rows(agency_id)
+
+    lats = [r[3] for r in rows if r[3] is not None]
+    lon_factor = math.cos(math.radians(float(sum(lats)) / len(lats))) if lats else 1.0
+
+    raw = _raw([r[3:] for r in rows], lon_factor)
+    with warnings.catch_warnings():
+        # colonnes entièrement vides (ex. salles_bain jamais renseigné)
+        warnings.simplefilter("ignore", RuntimeWarning)
+        medians = np.nan_to_num(np.nanmedian(raw, axis=0)) if rows else np.zeros(len(FEATURES))
+        scales = np.nanstd(raw, axis=0) if rows else np.ones(len(FEATURES))
+    scales = np.where(np.isfinite(scales) & (scales > 0), scales, 1.0)
+    scales[len(NUMERIC):] = 1.0  # équipements : 0/1, pas de normalisation
+
+    return FeatureMatrix(
+        ids=np.array([r[0] for r in rows], dtype=np.int64),
+        property_types=np.array([r[1] for r in rows], dtype=object),
+        operation_types=np.array([r[2] for r in rows], dtype=object),
+        matrix=_normalize(raw, medians, scales),
+        medians=medians,
+        scales=scales,
+        lon_factor=lon_factor,
+        weights=_weights(),
+    )
+
+
+def _normalize(raw, medians, scales):
+    filled = np.where(np.isnan(raw), medians, raw)
+    return (filled - medians) / scales
+
+
+def _update(agency_id, fm, changed_ids):
+    """
+    Rafraîchissement incrémental : les lignes modifiées sont retirées puis
+    relues (si toujours actives). Médianes et échelles restent celles de
+    la dernière reconstruction complète.
+    """
+    rows = _rows(agency_id, changed_ids)
+    keep = ~np.isin(fm.ids, list(changed_ids))
+    raw = _raw([r[3:] for r in rows], fm.lon_factor)
+
+    return fm._replace(
+        ids=np.concatenate([fm.ids[keep], np.array([r[0] for r in rows], dtype=np.int64)]),
+        property_types=np.concatenate([fm.property_types[keep], np.array([r[1] for r in rows], dtype=object)]),
+        operation_types=np.concatenate([fm.operation_types[keep], np.array([r[2] for r in rows], dtype=object)]),
+        matrix=np.concatenate([fm.matrix[keep], _normalize(raw, fm.medians, fm.scales)]),
+    )
+
+
+_matrices = VersionedCache("pricing", _build, _update)
+
+
+def feature_matrix(agency_id):
+    return _matrices.get(agency_id)
+
+
+def invalidate(agency_id, property_id=None):
+    """Invalide la matrice de l'agence dans tous les workers, après commit."""
+    _matrices.invalidate(agency_id, property_id)
+
+
+# ----------------------------------------------------------
+# COMPARABLES
+# ----------------------------------------------------------
+
+def comparables(prop, k=10):
+    """
+    Les k biens de même type et opération les plus proches de `prop`
+    (distance pondérée). Retourne [(id, distance)], du plus proche au
+    plus lointain.
+    """
+    fm = feature_matrix(prop.agency_id)
+    if not len(fm.ids):
+        return []
+
+    mask = (
+        (fm.property_types == prop.property_type)
+        & (fm.operation_types == prop.operation_type)
+        & (fm.ids != prop.pk)
+    )
+    idx = np.flatnonzero(mask)
+    if not len(idx):
+        return []
+
+    query = _normalize(
+        _raw([[getattr(prop, f) for f in FEATURES]], fm.lon_factor),
+        fm.medians, fm.scales,
+    )[0]
+    diff = fm.matrix[idx] - query
+    dist = np.sqrt((diff * diff) @ fm.weights)
+
+    k = min(k, len(idx))
+    top = np.argpartition(dist, k - 1)[:k]
+    top = top[np.argsort(dist[top])]
+    return [(int(fm.ids[idx[i]]), float(dist[i])) for i in top]
+
+
+# ----------------------------------------------------------
+# PRIX AU M² : STATISTIQUES PRÉCALCULÉES
+# ----------------------------------------------------------
+
+def cell_of(latitude, longitude):
+    return price_cell(latitude, longitude, settings.PRICE_CELL_DEGREES)
+
+
+def stat_key(prop):
+    """Groupe du bien tel qu'enregistré (Property.price_cell, calculé par save())."""
+    return (prop.agency_id, prop.property_type, prop.operation_type, prop.price_cell)
+
+
+def mark_dirty(*keys):
+    """Marque des groupes (agency_id, type, opération, cellule) à recalculer."""
+    keys = {k for k in keys if k and k[0]}
+    if not keys:
+        return
+    now = timezone.now()
+    PriceStat.objects.bulk_create(
+        [
+            PriceStat(agency_id=a, property_type=t, operation_type=o, cell=c, dirty=True, marked_at=now)
+            for a, t, o, c in keys
+        ],
+        update_conflicts=True,
+        unique_fields=["agency", "property_type", "operation_type", "cell"],
+        update_fields=["dirty", "marked_at"],
+    )
+
+
+def property_changed(prop, previous_key=None):
+    """À appeler après écriture d'un bien (création, mise à jour, suppression)."""
+    invalidate(prop.agency_id, prop.pk)
+    if previous_key and previous_key[0] != prop.agency_id:
+        invalidate(previous_key[0], prop.pk)
+    mark_dirty(stat_key(prop), previous_key)
+
+
+def _group_queryset(stat):
+    return Property.objects.filter(
+        agency_id=stat.agency_id,
+        property_type=stat.property_type,
+        operation_type=stat.operation_type,
+        price_cell=stat.cell,
+        is_deleted=False,
+        area__gt=0,
+    )
+
+
+def refresh_price_stats(limit=1000):
+    """
+    Recalcule uniquement les groupes marqués `dirty`. Un groupe marqué de
+    nouveau pendant le calcul (marked_at changé) reste dirty.
+    """
+    done = 0
+    for stat in PriceStat.objects.filter(dirty=True).order_by("id")[:limit]:
+        current = PriceStat.objects.filter(pk=stat.pk, marked_at=stat.marked_at)
+        rows = np.array(list(_group_queryset(stat).values_list("price", "area")), dtype=float)
+        if not len(rows):
+            current.delete()
+            continue
+
+        ppm2 = rows[:, 0] / rows[:, 1]
+        p10, p25, p50, p75, p90 = (float(v) for v in np.percentile(ppm2, [10, 25, 50, 75, 90]))
+        done += current.update(
+            count=len(ppm2), p10=p10, p25=p25, p50=p50, p75=p75, p90=p90,
+            dirty=False, updated_at=timezone.now(),
+        )
+    return done
+
+
+def backfill_cells(agency_id=None, chunk_size=2000):
+    """
+    Recalcule Property.price_cell pour les lignes écrites sans save()
+    (QuerySet.update(), imports) ; seules les cellules changées sont écrites.
+    """
+    qs = Property.objects.all()
+    if agency_id:
+        qs = qs.filter(agency_id=agency_id)
+
+    fixed = 0
+    last = 0
+    while True:
+        rows = list(
+            qs.filter(pk__gt=last).order_by("pk")
+            .values_list("pk", "latitude", "longitude", "price_cell")[:chunk_size]
+        )
+        if not rows:
+            return fixed
+        stale = [
+            Property(pk=pk, price_cell=cell)
+            for pk, lat, lon, stored in rows
+            if (cell := cell_of(lat, lon)) != stored
+        ]
+        if stale:
+            Property.objects.bulk_update(stale, ["price_cell"])
+            fixed += len(stale)
+        last = rows[-1][0]
+
+
+def mark_all_dirty(agency_id=None):
+    """Reconstruction complète : marque tous les groupes, existants ou non."""
+    backfill_cells(agency_id)
+
+    qs = Property.objects.filter(is_deleted=False, area__gt=0)
+    stats = PriceStat.objects.all()
+    if agency_id:
+        qs = qs.filter(agency_id=agency_id)
+        stats = stats.filter(agency_id=agency_id)
+
+    stats.update(dirty=True, marked_at=timezone.now())
+    keys = set(
+        qs.values_list("agency_id", "property_type", "operation_type", "price_cell")
+        .distinct().iterator()
+    )
+    mark_dirty(*keys)
+    return len(keys)
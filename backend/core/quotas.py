@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from rest_framework.exceptions import PermissionDenied
+
+from .models import Agency, Property
+from .throttles import agency_policy
+
+# ----------------------------------------------------------
+# QUOTAS PAR PLAN
+# ----------------------------------------------------------
+# Les compteurs vivent sur Agency (property_count, user_count). Une
+# réservation est un UPDATE conditionnel : pas de COUNT(*) à l'écriture.
+# recount_quotas() resynchronise périodiquement (soft-delete, admin...).
+
+QUOTA_FIELDS = {
+    "properties": "property_count",
+    "users": "user_count",
+}
+
+
+class QuotaExceeded(PermissionDenied):
+    default_detail = "Quota de votre offre atteint."
+    default_code = "quota_exceeded"
+
+
+def quota_limit(agency_id, resource):
+    plan, _ = agency_policy(agency_id)
+    quotas = settings.PLAN_QUOTAS
+    return quotas.get(plan, quotas["starter"]).get(resource)
+
+
+def reserve(agency_id, resource):
+    """Réserve une place ; lève QuotaExceeded si le plafond est atteint."""
+    if not agency_id:
+        return
+
+    field = QUOTA_FIELDS[resource]
+    limit = quota_limit(agency_id, resource)
+    qs = Agency.objects.filter(pk=agency_id)
+    if limit is not None:
+        qs = qs.filter(**{f"{field}__lt": limit})
+
+    if not qs.update(**{field: F(field) + 1}):
+        raise QuotaExceeded(f"Quota « {resource} » atteint ({limit}) pour votre offre.")
+
+
+def release(agency_id, resource):
+    if not agency_id:
+        return
+    field = QUOTA_FIELDS[resource]
+    Agency.objects.filter(pk=agency_id).update(**{field: Greatest(F(field) - 1, 0)})
+
+
+def recount_quotas():
+    """Recalcule les compteurs en une requête groupée par ressource."""
+    User = get_user_model()
+    counts = {
+        "property_count": dict(
+            Property.objects.filter(is_deleted=False)
+            .values_list("agency").annotate(n=Count("id"))
+        ),
+        "user_count": dict(
+            User.objects.filter(agency__isnull=False, is_active=True)
+            .values_list("agency").annotate(n=Count("id"))
+        ),
+    }
+
+    agencies = list(Agency.objects.only("id", "property_count", "user_count"))
+    changed = []
+    for agency in agencies:
+        dirty = False
+        for field, per_agency in counts.items():
+            value = per_agency.get(agency.id, 0)
+            if getattr(agency, field) != value:
+                setattr(agency, field, value)
+                dirty = True
+        if dirty:
+            changed.append(agency)
+
+    Agency.objects.bulk_update(changed, list(counts), batch_size=500)
+    return len(changed)
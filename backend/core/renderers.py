@@ -0,0 +1,60 @@
+import decimal
+
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # dépendance optionnelle : repli sur le rendu DRF standard
+    orjson = None
+
+# ----------------------------------------------------------
+# RENDU JSON RAPIDE
+# ----------------------------------------------------------
+
+_drf_encoder = encoders.JSONEncoder()
+
+
+def _default(obj):
+    """
+    Types non natifs pour orjson. Les Decimal sont écrits tels quels
+    (nombre JSON exact, sans passage par float) ; le reste (lazy strings,
+    querysets, timedelta...) suit l'encodeur DRF pour un rendu identique.
+    """
+    if isinstance(obj, decimal.Decimal):
+        if obj.is_finite() and hasattr(orjson, "Fragment"):
+            return orjson.Fragment(str(obj).encode())
+        return str(obj)
+    return _drf_encoder.default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer basé sur orjson quand il est installé. L'indentation
+    (API navigable, `; indent=`) passe par le rendu DRF standard.
+    """
+    # datetime natifs, « Z » pour UTC comme l'encodeur DRF
+    options = 0 if orjson is None else (
+        orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if data is None:
+            return b""
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=_default, option=self.options)
+        except orjson.JSONEncodeError:
+            # entiers au-delà de 64 bits, clés non sérialisables... : rendu DRF
+            return super().render(data, accepted_media_type, renderer_context)
+        # même échappement que DRF : JSON sous-ensemble strict de JavaScript
+        if b"\xe2\x80" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
@@ -1,9 +1,12 @@
+from django.conf import settings
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import (
     Agency, Owner, Property, Document, Client,
-    Visit, Claim, FinanceEntry
+    Visit, Claim, FinanceEntry, PriceStat, WebhookEndpoint,
+    AlertNotification, DuplicateGroup
 )
+from .webhooks import UnsafeWebhookURL, WebhookResolutionError, resolve_url
 
 User = get_user_model()
 
@@ -24,6 +27,12 @@ class AgencySerializer(serializers.ModelSerializer):
     class Meta:
         model = Agency
         fields = "__all__"
+        # plan et abonnement : modifiables par le superadmin uniquement
+        read_only_fields = ("plan", "subscription_expires", "property_count", "user_count")
+
+class AgencyAdminSerializer(AgencySerializer):
+    class Meta(AgencySerializer.Meta):
+        read_only_fields = ("property_count", "user_count")
 
 # -----------------------------
 # PROPRIÉTAIRE
@@ -44,6 +53,15 @@ class PropertySerializer(serializers.ModelSerializer):
         fields = "__all__"
         read_only_fields = ("created_by", "created_at")
 
+class ComparableSerializer(PropertySerializer):
+    distance = serializers.FloatField(read_only=True)
+    price_per_m2 = serializers.SerializerMethodField()
+
+    def get_price_per_m2(self, obj):
+        if not obj.area:
+            return None
+        return round(float(obj.price) / obj.area, 2)
+
 # -----------------------------
 # DOCUMENTS
 # -----------------------------
@@ -62,6 +80,17 @@ class ClientSerializer(serializers.ModelSerializer):
         model = Client
         fields = "__all__"
 
+class AlertNotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AlertNotification
+        fields = "__all__"
+
+class DuplicateGroupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DuplicateGroup
+        fields = "__all__"
+        read_only_fields = ("agency", "model_label", "member_ids", "score", "created_at")
+
 # -----------------------------
 # VISITES
 # -----------------------------
@@ -88,3 +117,57 @@ class FinanceSerializer(serializers.ModelSerializer):
     class Meta:
         model = FinanceEntry
         fields = "__all__"
+
+# -----------------------------
+# STATISTIQUES DE PRIX
+# -----------------------------
+
+class PriceStatSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PriceStat
+        exclude = ("id", "agency", "dirty", "marked_at")
+
+# -----------------------------
+# WEBHOOKS
+# -----------------------------
+
+class WebhookEndpointSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WebhookEndpoint
+        fields = "__all__"
+        read_only_fields = ("agency", "created_at")
+        extra_kwargs = {"secret": {"write_only": True}}
+
+    def validate_url(self, value):
+        try:
+            resolve_url(value)
+        except (UnsafeWebhookURL, WebhookResolutionError) as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
+
+# -----------------------------
+# REQUÊTES GROUPÉES
+# -----------------------------
+
+class BatchItemSerializer(serializers.Serializer):
+    id = serializers.CharField(required=False, allow_null=True)
+    method = serializers.ChoiceField(choices=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False, allow_null=True)
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict) and isinstance(data.get("method"), str):
+            data = {**data, "method": data["method"].upper()}
+        return super().to_internal_value(data)
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = serializers.ListField(child=BatchItemSerializer(), min_length=1)
+    concurrent = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        # lu à chaque appel : le réglage peut changer sans réimport
+        limit = settings.BATCH_MAX_REQUESTS
+        if len(value) > limit:
+            raise serializers.ValidationError(f"Au plus {limit} requêtes par lot.")
+        return value
@@ -0,0 +1,72 @@
+from celery import shared_task
+
+from .alerts import fan_out
+from .archive import archive_cold_data
+from .dedupe import propose_merge_groups
+from .pricing import mark_all_dirty, refresh_price_stats
+from .quotas import recount_quotas
+from .webhooks import dispatch
+
+# ----------------------------------------------------------
+# ARCHIVAGE DES DONNÉES FROIDES
+# ----------------------------------------------------------
+
+@shared_task
+def archive_cold_data_task(max_batches=None):
+    """
+    Passage périodique ; `max_batches` borne la durée d'un passage,
+    le suivant reprend là où celui-ci s'est arrêté.
+    """
+    return archive_cold_data(max_batches=max_batches)
+
+
+# ----------------------------------------------------------
+# QUOTAS
+# ----------------------------------------------------------
+
+@shared_task
+def recount_quotas_task():
+    """Resynchronise les compteurs de quotas des agences."""
+    return recount_quotas()
+
+
+# ----------------------------------------------------------
+# STATISTIQUES DE PRIX
+# ----------------------------------------------------------
+
+@shared_task
+def refresh_price_stats_task(full=False):
+    """Recalcule les groupes modifiés ; `full` force une reconstruction."""
+    if full:
+        mark_all_dirty()
+    return refresh_price_stats()
+
+
+# ----------------------------------------------------------
+# WEBHOOKS
+# ----------------------------------------------------------
+
+@shared_task
+def dispatch_webhooks_task():
+    """Vide l'outbox et envoie les webhooks échus."""
+    return dispatch()
+
+
+# ----------------------------------------------------------
+# ALERTES CLIENTS
+# ----------------------------------------------------------
+
+@shared_task
+def property_alerts_task(property_id, reason):
+    """Notifie les clients dont les critères correspondent au bien."""
+    return fan_out(property_id, reason)
+
+
+# ----------------------------------------------------------
+# DOUBLONS
+# ----------------------------------------------------------
+
+@shared_task
+def propose_duplicates_task(agency_id=None):
+    """Recalcule les groupes de doublons proposés à la fusion."""
+    return propose_merge_groups(agency_id=agency_id)
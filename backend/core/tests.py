@@ -0,0 +1,347 @@
+import json
+import socket
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import throttles, webhooks
+from .archive import archive_cold_data, restore_record
+from .models import (
+    Agency, AlertNotification, ArchivedRecord, Client, Document, OutboxEvent, Property,
+    User, Visit, WebhookDelivery, WebhookEndpoint,
+)
+from .serializers import WebhookEndpointSerializer
+
+# ----------------------------------------------------------
+# WEBHOOKS
+# ----------------------------------------------------------
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Répond avec le prochain code de `server.statuses` (204 une fois vide)."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append((body, dict(self.headers)))
+        status = self.server.statuses.pop(0) if self.server.statuses else 204
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_URLS=True, WEBHOOK_BACKOFF_BASE=30)
+class WebhookDispatchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.server.received = []
+        cls.server.statuses = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.received.clear()
+        self.server.statuses.clear()
+        self.agency = Agency.objects.create(name="A")
+        self.endpoint = WebhookEndpoint.objects.create(
+            agency=self.agency,
+            url=f"http://127.0.0.1:{self.server.server_port}/hook",
+            secret="s3cret",
+        )
+        self.prop = Property.objects.create(
+            agency=self.agency, title="T", property_type="villa",
+            operation_type="vente", address="1 rue A", price=100,
+        )
+
+    def record_status(self, status):
+        self.prop.status = status
+        webhooks.record("property.status_changed", self.prop, {"status": status})
+
+    def test_events_for_same_object_are_coalesced(self):
+        self.record_status("loue")
+        self.record_status("vendu")
+        webhooks.record("property.created", self.prop, {"status": "disponible"})
+
+        self.assertEqual(webhooks.drain_outbox(), 3)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+        delivery = WebhookDelivery.objects.get()
+        types = [(e["type"], e["data"]["status"]) for e in delivery.events]
+        self.assertEqual(types, [("property.status_changed", "vendu"), ("property.created", "disponible")])
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        self.server.statuses[:] = [500]
+        self.record_status("vendu")
+
+        result = webhooks.dispatch()
+        self.assertEqual((result["delivered"], result["failed"]), (0, 1))
+
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.attempts), ("pending", 1))
+        self.assertIn("500", delivery.last_error)
+        delay = (delivery.next_attempt_at - timezone.now()).total_seconds()
+        self.assertTrue(25 < delay <= 30, delay)
+
+        # pas encore échue : rien n'est renvoyé
+        self.assertEqual(webhooks.deliver_due(), (0, 0))
+
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(webhooks.deliver_due(), (1, 0))
+
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.attempts), ("delivered", 2))
+
+        self.assertEqual(len(self.server.received), 2)
+        body, headers = self.server.received[-1]
+        self.assertEqual(json.loads(body)["events"][0]["data"], {"status": "vendu"})
+        self.assertEqual(headers["X-Avei-Delivery"], str(delivery.id))
+        self.assertEqual(headers["X-Avei-Signature"], f"sha256={webhooks.sign('s3cret', body)}")
+
+    def test_backoff_doubles_up_to_max(self):
+        self.assertEqual(webhooks._backoff(1), timedelta(seconds=30))
+        self.assertEqual(webhooks._backoff(3), timedelta(seconds=120))
+        with self.settings(WEBHOOK_BACKOFF_MAX=100):
+            self.assertEqual(webhooks._backoff(5), timedelta(seconds=100))
+
+    def test_gives_up_after_max_attempts(self):
+        self.server.statuses[:] = [503, 503]
+        self.record_status("vendu")
+        webhooks.drain_outbox()
+
+        with self.settings(WEBHOOK_MAX_ATTEMPTS=2):
+            webhooks.deliver_due()
+            WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+            webhooks.deliver_due()
+
+        self.assertEqual(WebhookDelivery.objects.get().status, "failed")
+
+    def test_private_address_refused_at_send_time(self):
+        # enregistrée avant le contrôle (ou DNS modifié depuis)
+        WebhookEndpoint.objects.filter(pk=self.endpoint.pk).update(url="https://127.0.0.1/hook")
+        self.record_status("vendu")
+        webhooks.drain_outbox()
+
+        with self.settings(WEBHOOK_ALLOW_PRIVATE_URLS=False):
+            self.assertEqual(webhooks.deliver_due(), (0, 1))
+
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual(delivery.status, "failed")
+        self.assertIn("127.0.0.1", delivery.last_error)
+
+    def test_dns_failure_is_retried(self):
+        WebhookEndpoint.objects.filter(pk=self.endpoint.pk).update(url="https://hooks.example.com/in")
+        self.record_status("vendu")
+        webhooks.drain_outbox()
+
+        error = socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")
+        with mock.patch("core.webhooks.socket.getaddrinfo", side_effect=error):
+            self.assertEqual(webhooks.deliver_due(), (0, 1))
+
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.attempts), ("pending", 1))
+        self.assertIn("hooks.example.com", delivery.last_error)
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+
+
+class WebhookURLTests(TestCase):
+    def fake_dns(self, *addresses):
+        infos = [(None, None, None, "", (addr, 443)) for addr in addresses]
+        return mock.patch("core.webhooks.socket.getaddrinfo", return_value=infos)
+
+    def test_refuses_plain_http(self):
+        with self.assertRaises(webhooks.UnsafeWebhookURL):
+            webhooks.resolve_url("http://93.184.216.34/hook")
+
+    def test_refuses_internal_addresses(self):
+        for address in ("127.0.0.1", "10.0.0.5", "172.18.0.3", "192.168.1.1",
+                        "169.254.169.254", "100.64.0.1", "::1", "::ffff:10.0.0.1", "fe80::1"):
+            with self.subTest(address=address), self.fake_dns(address):
+                with self.assertRaises(webhooks.UnsafeWebhookURL):
+                    webhooks.resolve_url("https://hooks.example.com/in")
+
+    def test_refuses_if_any_resolved_address_is_internal(self):
+        with self.fake_dns("93.184.216.34", "10.0.0.5"):
+            with self.assertRaises(webhooks.UnsafeWebhookURL):
+                webhooks.resolve_url("https://hooks.example.com/in")
+
+    def test_serializer_refuses_internal_url(self):
+        serializer = WebhookEndpointSerializer(data={"url": "https://169.254.169.254/latest/"})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("url", serializer.errors)
+
+    def test_accepts_public_https(self):
+        with self.fake_dns("93.184.216.34"):
+            self.assertEqual(
+                webhooks.resolve_url("https://hooks.example.com:8443/in?x=1"),
+                ("https", "hooks.example.com", 8443, "/in?x=1", "93.184.216.34"),
+            )
+
+
+# ----------------------------------------------------------
+# ARCHIVAGE
+# ----------------------------------------------------------
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.agency = Agency.objects.create(name="A")
+        self.agent = User.objects.create(username="agent", agency=self.agency, role="agent")
+        self.client_ = Client.objects.create(agency=self.agency, name="Client")
+        self.prop = Property.objects.create(
+            agency=self.agency, title="T", property_type="villa",
+            operation_type="vente", address="1 rue A", price=100,
+        )
+        self.prop.agents.add(self.agent)
+        self.client_.interested_properties.add(self.prop)
+
+    def make_cold(self, obj):
+        obj.soft_delete()
+        type(obj).objects.filter(pk=obj.pk).update(deleted_at=timezone.now() - timedelta(days=400))
+
+    def archive(self):
+        return archive_cold_data(sleep=0)
+
+    def test_blocked_parent_waits_for_its_children(self):
+        doc = Document.objects.create(agency=self.agency, property=self.prop, file="a.pdf")
+        visit = Visit.objects.create(property=self.prop, client=self.client_, scheduled_at=timezone.now())
+        self.make_cold(doc)
+        self.make_cold(self.prop)
+
+        # la visite est encore chaude : le document part, le bien reste
+        self.assertEqual(self.archive(), {"core.Document": 1})
+        self.assertTrue(Property.objects.filter(pk=self.prop.pk).exists())
+
+        self.make_cold(visit)
+        self.assertEqual(self.archive(), {"core.Visit": 1, "core.Property": 1})
+        self.assertFalse(Property.objects.filter(pk=self.prop.pk).exists())
+
+    def test_disposable_children_do_not_block(self):
+        AlertNotification.objects.create(
+            agency=self.agency, client=self.client_, property=self.prop, reason="new",
+        )
+        self.make_cold(self.prop)
+
+        self.assertEqual(self.archive(), {"core.Property": 1})
+        self.assertFalse(AlertNotification.objects.exists())
+
+    def test_restore_brings_back_parents_and_m2m(self):
+        doc = Document.objects.create(agency=self.agency, property=self.prop, file="a.pdf")
+        self.make_cold(doc)
+        self.make_cold(self.prop)
+        self.archive()
+        self.assertFalse(Property.objects.filter(pk=self.prop.pk).exists())
+
+        restored = restore_record("core.Document", doc.pk)
+
+        prop = Property.objects.get(pk=self.prop.pk)
+        self.assertEqual(restored.property_id, prop.pk)
+        self.assertEqual(list(prop.agents.all()), [self.agent])
+        self.assertEqual(list(prop.interested_clients.all()), [self.client_])
+        self.assertFalse(ArchivedRecord.objects.exists())
+
+    def test_restore_command(self):
+        self.make_cold(self.prop)
+        self.archive()
+
+        out = StringIO()
+        call_command("archive_cold_data", "--restore", f"core.Property:{self.prop.pk}", stdout=out)
+        self.assertIn(f"core.Property#{self.prop.pk}", out.getvalue())
+
+        for target in ("core.Property", "core.Property:x", "core.Property:1:2"):
+            with self.subTest(target=target), self.assertRaisesMessage(CommandError, "LABEL:ID"):
+                call_command("archive_cold_data", "--restore", target)
+
+        for target in (f"core.Property:{self.prop.pk}", "core.Nope:1"):
+            with self.subTest(target=target), self.assertRaises(CommandError):
+                call_command("archive_cold_data", "--restore", target)
+
+
+# ----------------------------------------------------------
+# REQUÊTES GROUPÉES
+# ----------------------------------------------------------
+
+class BatchTests(TestCase):
+    def setUp(self):
+        throttles._bucket = throttles.LocalTokenBucket()
+        self.agency = Agency.objects.create(name="A", plan="enterprise")
+        other = Agency.objects.create(name="B", plan="enterprise")
+        self.user = User.objects.create(username="director", agency=self.agency, role="director")
+        self.prop = self.make_property(self.agency)
+        self.foreign = self.make_property(other)
+
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def make_property(self, agency):
+        return Property.objects.create(
+            agency=agency, title="Villa piscine", property_type="villa",
+            operation_type="vente", address="12 rue Ibn Sina Casablanca", price=100,
+        )
+
+    def batch(self, *requests, **extra):
+        return self.api.post("/api/batch/", {"requests": list(requests), **extra}, format="json")
+
+    def test_status_per_item(self):
+        response = self.batch(
+            {"id": "own", "method": "GET", "path": f"/api/properties/{self.prop.pk}/"},
+            {"id": "other", "method": "get", "path": f"/api/properties/{self.foreign.pk}/"},
+            {"id": "edit", "method": "PATCH", "path": f"/api/properties/{self.prop.pk}/", "body": {"status": "loue"}},
+        )
+        self.assertEqual(response.status_code, 200)
+        results = {item["id"]: item for item in response.json()}
+        self.assertEqual(results["own"]["status"], 200)
+        self.assertEqual(results["own"]["body"]["id"], self.prop.pk)
+        self.assertEqual(results["other"]["status"], 404)
+        self.assertEqual(results["edit"]["status"], 200)
+
+        self.prop.refresh_from_db()
+        self.assertEqual(self.prop.status, "loue")
+
+    def test_returns_duplicate_header(self):
+        body = {
+            "agency": self.agency.pk, "title": "Villa avec piscine", "property_type": "villa",
+            "operation_type": "vente", "address": "12, Rue Ibn Sina, Casablanca", "price": "110.00",
+        }
+        item = self.batch({"method": "POST", "path": "/api/properties/", "body": body}).json()[0]
+        self.assertEqual(item["status"], 201)
+        self.assertEqual(item["headers"]["X-Possible-Duplicates"], str(self.prop.pk))
+
+    def test_refuses_nested_batch_and_foreign_paths(self):
+        results = self.batch(
+            {"method": "POST", "path": "/api/batch/", "body": {"requests": []}},
+            {"method": "GET", "path": "/admin/"},
+            {"method": "GET", "path": "/api/nope/"},
+        ).json()
+        self.assertEqual([item["status"] for item in results], [400, 404, 404])
+        self.assertIn("/api/", results[1]["body"]["detail"])
+
+    def test_size_limit_read_per_request(self):
+        item = {"method": "GET", "path": f"/api/properties/{self.prop.pk}/"}
+        with self.settings(BATCH_MAX_REQUESTS=2):
+            response = self.batch(item, item, item)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("requests", response.json())
+        self.assertEqual(self.batch(item, item, item).status_code, 200)
+
+    def test_throttle_charged_once_for_the_batch(self):
+        bucket = throttles._bucket
+        item = {"method": "GET", "path": f"/api/properties/{self.prop.pk}/"}
+        with mock.patch.object(bucket, "consume", wraps=bucket.consume) as consume:
+            self.batch(item, item, item)
+
+        consume.assert_called_once()
+        self.assertEqual(consume.call_args.args[3], 3)
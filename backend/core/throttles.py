@@ -0,0 +1,155 @@
+import threading
+import time
+
+import redis
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .models import Agency
+
+# ----------------------------------------------------------
+# POLITIQUE D'AGENCE (plan + abonnement), cache processus
+# ----------------------------------------------------------
+
+_policy_cache = {}
+_policy_lock = threading.Lock()
+
+
+def agency_policy(agency_id):
+    """
+    Retourne (plan, subscription_expires) de l'agence. Mis en cache
+    AGENCY_POLICY_TTL secondes pour éviter une requête SQL par appel API.
+    """
+    now = time.monotonic()
+    cached = _policy_cache.get(agency_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    policy = (
+        Agency.objects.filter(pk=agency_id)
+        .values_list("plan", "subscription_expires")
+        .first()
+    ) or ("starter", None)
+
+    with _policy_lock:
+        _policy_cache[agency_id] = (now + getattr(settings, "AGENCY_POLICY_TTL", 60), policy)
+    return policy
+
+
+def forget_agency_policy(agency_id):
+    _policy_cache.pop(agency_id, None)
+
+
+# ----------------------------------------------------------
+# TOKEN BUCKET
+# ----------------------------------------------------------
+
+# Un seul aller-retour Redis : lecture, recharge et consommation atomiques.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3]) or 1
+local t = redis.call("TIME")
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class LocalTokenBucket:
+    """Repli en mémoire (par processus) quand Redis est indisponible."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def consume(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self.lock:
+            tokens, ts = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - ts) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+        return allowed, tokens
+
+
+class RedisTokenBucket:
+    RETRY_AFTER = 30  # secondes avant de retenter Redis après une panne
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self.script = self.client.register_script(TOKEN_BUCKET_LUA)
+        self.fallback = LocalTokenBucket()
+        self.down_until = 0
+
+    def consume(self, key, rate, burst, cost=1):
+        if time.monotonic() < self.down_until:
+            return self.fallback.consume(key, rate, burst, cost)
+        try:
+            allowed, tokens = self.script(keys=[key], args=[rate, burst, cost])
+        except redis.RedisError:
+            self.down_until = time.monotonic() + self.RETRY_AFTER
+            return self.fallback.consume(key, rate, burst, cost)
+        return bool(allowed), float(tokens)
+
+
+_bucket = None
+
+
+def get_bucket():
+    global _bucket
+    if _bucket is None:
+        url = getattr(settings, "THROTTLE_REDIS_URL", None)
+        _bucket = RedisTokenBucket(url) if url else LocalTokenBucket()
+    return _bucket
+
+
+# ----------------------------------------------------------
+# THROTTLE DRF PAR AGENCE
+# ----------------------------------------------------------
+
+class AgencyPlanThrottle(BaseThrottle):
+    """
+    Limite le débit par agence selon son plan (PLAN_THROTTLE_RATES :
+    jetons/seconde et rafale). Les comptes sans agence ne sont pas limités.
+
+    Une vue peut coûter plusieurs jetons (`throttle_cost(request)`, cf.
+    BatchView), plafonnés à la rafale pour rester réalisable. Les
+    sous-requêtes d'un appel groupé, déjà décomptées, ne sont pas limitées.
+    """
+    scope = "agency"
+
+    def allow_request(self, request, view):
+        agency_id = getattr(request.user, "agency_id", None)
+        if not agency_id or getattr(request, "batch_item", False):
+            return True
+
+        plan, _ = agency_policy(agency_id)
+        rates = settings.PLAN_THROTTLE_RATES
+        self.rate, self.burst = rates.get(plan, rates["starter"])
+
+        cost = view.throttle_cost(request) if hasattr(view, "throttle_cost") else 1
+        self.cost = max(1, min(cost, self.burst))
+
+        allowed, self.tokens = get_bucket().consume(
+            f"throttle:{self.scope}:{agency_id}", self.rate, self.burst, self.cost
+        )
+        return allowed
+
+    def wait(self):
+        return max(0.0, (self.cost - self.tokens) / self.rate)
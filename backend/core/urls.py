@@ -4,7 +4,9 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     AgencyViewSet, UserViewSet, OwnerViewSet, PropertyViewSet,
     DocumentViewSet, ClientViewSet, VisitViewSet, ClaimViewSet,
-    FinanceViewSet
+    FinanceViewSet, WebhookEndpointViewSet, AlertNotificationViewSet,
+    DuplicateGroupViewSet,
+    PriceAnalyticsView, BatchView
 )
 
 router = DefaultRouter()
@@ -19,7 +21,12 @@ router.register(r"clients", ClientViewSet, basename="clients")
 router.register(r"visits", VisitViewSet, basename="visits")
 router.register(r"claims", ClaimViewSet, basename="claims")
 router.register(r"finances", FinanceViewSet, basename="finances")
+router.register(r"webhooks", WebhookEndpointViewSet, basename="webhooks")
+router.register(r"alerts", AlertNotificationViewSet, basename="alerts")
+router.register(r"duplicates", DuplicateGroupViewSet, basename="duplicates")
 
 urlpatterns = [
+    path("analytics/prices/", PriceAnalyticsView.as_view(), name="analytics-prices"),
+    path("batch/", BatchView.as_view(), name="batch"),
     path("", include(router.urls)),
 ]
@@ -0,0 +1,100 @@
+import logging
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------
+# VALEURS PAR AGENCE : CACHE PROCESSUS VERSIONNÉ
+# ----------------------------------------------------------
+# Chaque processus garde sa propre copie (matrice de prix, index des
+# critères clients...). Un numéro de version partagé (cache Django, Redis
+# en production) signale les écritures validées. Quand `update` est
+# fourni, l'id modifié est journalisé avec sa version : un processus en
+# retard ne relit que ces lignes au lieu de tout reconstruire.
+# Cache indisponible : les écritures ne sont pas bloquées (erreur
+# journalisée) et les lectures reconstruisent sans se fier à la copie.
+
+
+class VersionedCache:
+    def __init__(self, prefix, build, update=None, max_changes=500, log_timeout=3600):
+        """
+        build(agency_id) -> valeur complète
+        update(agency_id, valeur, ids modifiés) -> nouvelle valeur (sans
+        modifier l'ancienne, lue par d'autres threads)
+        """
+        self.prefix = prefix
+        self.build = build
+        self.update = update
+        self.max_changes = max_changes
+        self.log_timeout = log_timeout
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _version_key(self, agency_id):
+        return f"{self.prefix}:version:{agency_id}"
+
+    def _change_key(self, agency_id, version):
+        return f"{self.prefix}:change:{agency_id}:{version}"
+
+    def invalidate(self, agency_id, changed_id=None):
+        """
+        Publie une nouvelle version, après validation de la transaction :
+        sinon un autre processus pourrait reconstruire depuis les anciennes
+        données et les garder sous la nouvelle version.
+        """
+        transaction.on_commit(lambda: self._bump(agency_id, changed_id))
+
+    def _bump(self, agency_id, changed_id):
+        # après commit : une erreur ici transformerait une écriture réussie en 500
+        try:
+            self._publish(agency_id, changed_id)
+        except Exception:
+            logger.exception("Invalidation %s impossible pour l'agence %s", self.prefix, agency_id)
+
+    def _publish(self, agency_id, changed_id):
+        key = self._version_key(agency_id)
+        if cache.add(key, 1, timeout=None):
+            version = 1
+        else:
+            try:
+                version = cache.incr(key)
+            except ValueError:  # clé expirée entre add() et incr()
+                cache.set(key, 1, timeout=None)
+                version = 1
+
+        if changed_id is not None and self.update is not None:
+            cache.set(self._change_key(agency_id, version), changed_id, self.log_timeout)
+
+    def get(self, agency_id):
+        # version lue avant les données : une écriture validée pendant la
+        # construction sera vue au prochain appel
+        try:
+            version = cache.get(self._version_key(agency_id), 0)
+        except Exception:
+            # version inconnue : la copie locale est peut-être périmée
+            logger.warning("Cache indisponible, %s reconstruit pour l'agence %s", self.prefix, agency_id)
+            return self.build(agency_id)
+
+        cached = self._values.get(agency_id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        value = None
+        if cached and self.update is not None and 0 < version - cached[0] <= self.max_changes:
+            keys = [self._change_key(agency_id, v) for v in range(cached[0] + 1, version + 1)]
+            try:
+                changes = cache.get_many(keys)
+            except Exception:
+                changes = {}
+            # journal incomplet (expiré, invalidation sans id) : reconstruction
+            if len(changes) == len(keys):
+                value = self.update(agency_id, cached[1], set(changes.values()))
+
+        if value is None:
+            value = self.build(agency_id)
+        with self._lock:
+            self._values[agency_id] = (version, value)
+        return value
@@ -1,22 +1,62 @@
+import logging
+
 from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from django.db import transaction
 from django.db.models import Q
 from django.contrib.auth import get_user_model
 
 from .models import (
     Agency, Owner, Property, Document, Client,
-    Visit, Claim, FinanceEntry
+    Visit, Claim, FinanceEntry, PriceStat, WebhookEndpoint,
+    AlertNotification, DuplicateGroup
 )
 from .serializers import (
-    AgencySerializer, OwnerSerializer, PropertySerializer, DocumentSerializer,
-    ClientSerializer, VisitSerializer, ClaimSerializer, FinanceSerializer,
-    UserSerializer
+    AgencySerializer, AgencyAdminSerializer, OwnerSerializer, PropertySerializer,
+    DocumentSerializer, ClientSerializer, VisitSerializer, ClaimSerializer, FinanceSerializer,
+    UserSerializer, ComparableSerializer, PriceStatSerializer,
+    WebhookEndpointSerializer, AlertNotificationSerializer, BatchSerializer,
+    DuplicateGroupSerializer
 )
 from .permissions import (
-    IsSuperAdmin, IsDirectorOfAgency, IsSameAgency, CanViewFinance
+    IsSuperAdmin, IsSuperAdminOrReadOnly, IsDirectorOfAgency, IsSameAgency,
+    CanViewFinance
 )
+from . import alerts, batch, dedupe, pricing, quotas, webhooks
+from .tasks import property_alerts_task
+from .throttles import forget_agency_policy
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+class DuplicateCheckMixin:
+    """
+    Signale les doublons probables : en-tête X-Possible-Duplicates sur la
+    création, et POST .../possible-duplicates/ pour vérifier avant saisie.
+    Seules les fiches visibles par l'utilisateur (get_queryset) sont citées.
+    """
+
+    def find_duplicates(self, data, exclude_id=None):
+        return dedupe.possible_duplicates(
+            self.queryset.model, self.request.user.agency_id, data,
+            exclude_id=exclude_id, queryset=self.get_queryset(),
+        )
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        matches = self.find_duplicates(request.data, exclude_id=response.data.get("id"))
+        if matches:
+            response["X-Possible-Duplicates"] = ",".join(str(pk) for pk, _ in matches)
+        return response
+
+    @action(detail=False, methods=["post"], url_path="possible-duplicates")
+    def possible_duplicates(self, request):
+        matches = self.find_duplicates(request.data, exclude_id=request.data.get("id"))
+        return Response([{"id": pk, "score": score} for pk, score in matches])
 
 # ----------------------------------------------------------
 # AGENCES
@@ -25,7 +65,7 @@ User = get_user_model()
 class AgencyViewSet(viewsets.ModelViewSet):
     queryset = Agency.objects.all()
     serializer_class = AgencySerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [*api_settings.DEFAULT_PERMISSION_CLASSES, IsSuperAdminOrReadOnly]
 
     def get_queryset(self):
         user = self.request.user
@@ -33,6 +73,15 @@ class AgencyViewSet(viewsets.ModelViewSet):
             return Agency.objects.all()
         return Agency.objects.filter(id=user.agency_id)
 
+    def get_serializer_class(self):
+        if self.request.user.role == "superadmin":
+            return AgencyAdminSerializer
+        return AgencySerializer
+
+    def perform_update(self, serializer):
+        agency = serializer.save()
+        forget_agency_policy(agency.id)
+
 
 # ----------------------------------------------------------
 # UTILISATEURS
@@ -41,7 +90,6 @@ class AgencyViewSet(viewsets.ModelViewSet):
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
@@ -54,15 +102,47 @@ class UserViewSet(viewsets.ModelViewSet):
 
         return User.objects.none()
 
+    # seuls les comptes actifs occupent une place (cf. recount_quotas)
+    @staticmethod
+    def _quota_agency(agency_id, is_active):
+        return agency_id if is_active else None
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        agency = data.get("agency")
+        quotas.reserve(self._quota_agency(agency and agency.id, data.get("is_active", True)), "users")
+        serializer.save()
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        # état verrouillé : deux mises à jour concurrentes ne comptent pas deux fois
+        current = User.objects.select_for_update().only("agency_id", "is_active").get(pk=serializer.instance.pk)
+        data = serializer.validated_data
+        agency_id = current.agency_id
+        if "agency" in data:
+            agency_id = data["agency"] and data["agency"].id
+
+        before = self._quota_agency(current.agency_id, current.is_active)
+        after = self._quota_agency(agency_id, data.get("is_active", current.is_active))
+        if before != after:
+            quotas.reserve(after, "users")
+            quotas.release(before, "users")
+        serializer.save()
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        quotas.release(self._quota_agency(instance.agency_id, instance.is_active), "users")
+        instance.delete()
+
 
 # ----------------------------------------------------------
 # PROPRIÉTAIRES
 # ----------------------------------------------------------
 
-class OwnerViewSet(viewsets.ModelViewSet):
+class OwnerViewSet(DuplicateCheckMixin, viewsets.ModelViewSet):
     queryset = Owner.objects.filter(is_deleted=False)
     serializer_class = OwnerSerializer
-    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
@@ -81,10 +161,9 @@ class OwnerViewSet(viewsets.ModelViewSet):
 # BIENS IMMOBILIERS
 # ----------------------------------------------------------
 
-class PropertyViewSet(viewsets.ModelViewSet):
+class PropertyViewSet(DuplicateCheckMixin, viewsets.ModelViewSet):
     queryset = Property.objects.filter(is_deleted=False)
     serializer_class = PropertySerializer
-    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
@@ -104,12 +183,74 @@ class PropertyViewSet(viewsets.ModelViewSet):
 
         return Property.objects.none()
 
+    @transaction.atomic
     def perform_create(self, serializer):
         user = self.request.user
-        serializer.save(
+        quotas.reserve(user.agency_id, "properties")
+        instance = serializer.save(
             agency=user.agency,
             created_by=user
         )
+        webhooks.record("property.created", instance, serializer.data)
+        pricing.property_changed(instance)
+        self.queue_alerts(instance, "new")
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous = pricing.stat_key(serializer.instance)
+        previous_status = serializer.instance.status
+        previous_price = serializer.instance.price
+        instance = serializer.save()
+        if instance.status != previous_status:
+            webhooks.record("property.status_changed", instance, serializer.data)
+        pricing.property_changed(instance, previous)
+        if alerts.property_alert_needed(instance, (previous_price, previous_status)):
+            self.queue_alerts(instance, "changed")
+
+    def queue_alerts(self, instance, reason):
+        if reason == "new" and not alerts.property_alert_needed(instance):
+            return
+
+        def send():
+            # le bien est déjà enregistré : une panne du broker ne doit pas
+            # transformer la réponse en 500
+            try:
+                property_alerts_task.delay(instance.pk, reason)
+            except Exception:
+                logger.exception("Alertes non planifiées pour le bien %s", instance.pk)
+
+        transaction.on_commit(send)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        if not instance.is_deleted:
+            quotas.release(instance.agency_id, "properties")
+        pricing.property_changed(instance)
+        instance.delete()
+
+    @action(detail=True, methods=["get"])
+    def comps(self, request, pk=None):
+        """Biens comparables les plus proches (?k=10, max 50)."""
+        prop = self.get_object()
+        try:
+            k = max(1, min(int(request.query_params.get("k", 10)), 50))
+        except ValueError:
+            k = 10
+
+        # marge : certains comparables peuvent être hors du périmètre de l'utilisateur
+        ranked = pricing.comparables(prop, k * 3)
+        distances = dict(ranked)
+        visible = {p.pk: p for p in self.get_queryset().filter(pk__in=distances)}
+
+        results = []
+        for pk_, distance in ranked:
+            if pk_ in visible:
+                visible[pk_].distance = distance
+                results.append(visible[pk_])
+            if len(results) == k:
+                break
+
+        return Response(ComparableSerializer(results, many=True).data)
 
 
 # ----------------------------------------------------------
@@ -119,7 +260,6 @@ class PropertyViewSet(viewsets.ModelViewSet):
 class DocumentViewSet(viewsets.ModelViewSet):
     queryset = Document.objects.filter(is_deleted=False)
     serializer_class = DocumentSerializer
-    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
@@ -134,10 +274,9 @@ class DocumentViewSet(viewsets.ModelViewSet):
 # CLIENTS
 # ----------------------------------------------------------
 
-class ClientViewSet(viewsets.ModelViewSet):
+class ClientViewSet(DuplicateCheckMixin, viewsets.ModelViewSet):
     queryset = Client.objects.filter(is_deleted=False)
     serializer_class = ClientSerializer
-    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
@@ -156,6 +295,76 @@ class ClientViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(agency=self.request.user.agency)
+        alerts.invalidate(self.request.user.agency_id)
+
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        alerts.invalidate(instance.agency_id)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        alerts.invalidate(instance.agency_id)
+
+
+# ----------------------------------------------------------
+# ALERTES (biens correspondant aux clients)
+# ----------------------------------------------------------
+
+class AlertNotificationViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = AlertNotification.objects.all()
+    serializer_class = AlertNotificationSerializer
+
+    def get_queryset(self):
+        user = self.request.user
+        qs = AlertNotification.objects.order_by("-created_at")
+
+        if user.role == "agent":
+            qs = qs.filter(agent=user)
+        elif user.role in ("director", "assistant"):
+            qs = qs.filter(agency=user.agency)
+        else:
+            return qs.none()
+
+        if self.request.query_params.get("unread"):
+            qs = qs.filter(read_at__isnull=True)
+        return qs
+
+    @action(detail=False, methods=["post"])
+    def read(self, request):
+        """Marque comme lues les alertes listées (`ids`) ou toutes."""
+        qs = self.get_queryset()
+        ids = request.data.get("ids")
+        if ids:
+            qs = qs.filter(pk__in=ids)
+        return Response({"updated": alerts.mark_read(qs)})
+
+
+# ----------------------------------------------------------
+# DOUBLONS (propositions de fusion)
+# ----------------------------------------------------------
+
+class DuplicateGroupViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = DuplicateGroup.objects.filter(status="proposed")
+    serializer_class = DuplicateGroupSerializer
+
+    def get_queryset(self):
+        user = self.request.user
+
+        if user.role not in ("director", "assistant"):
+            return DuplicateGroup.objects.none()
+
+        qs = DuplicateGroup.objects.filter(agency=user.agency, status="proposed")
+        model_label = self.request.query_params.get("model")
+        if model_label:
+            qs = qs.filter(model_label=model_label)
+        return qs.order_by("-score")
+
+    @action(detail=True, methods=["post"])
+    def dismiss(self, request, pk=None):
+        group = self.get_object()
+        group.status = "dismissed"
+        group.save(update_fields=["status"])
+        return Response(DuplicateGroupSerializer(group).data)
 
 
 # ----------------------------------------------------------
@@ -165,7 +374,6 @@ class ClientViewSet(viewsets.ModelViewSet):
 class VisitViewSet(viewsets.ModelViewSet):
     queryset = Visit.objects.filter(is_deleted=False)
     serializer_class = VisitSerializer
-    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
@@ -179,6 +387,14 @@ class VisitViewSet(viewsets.ModelViewSet):
 
         return qs.filter(property__agency=user.agency)
 
+    @transaction.atomic
+    def perform_create(self, serializer):
+        instance = serializer.save()
+        webhooks.record(
+            "visit.created", instance, serializer.data,
+            agency_id=instance.property.agency_id,
+        )
+
 
 # ----------------------------------------------------------
 # RÉCLAMATIONS
@@ -187,7 +403,6 @@ class VisitViewSet(viewsets.ModelViewSet):
 class ClaimViewSet(viewsets.ModelViewSet):
     queryset = Claim.objects.filter(is_deleted=False)
     serializer_class = ClaimSerializer
-    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
@@ -209,7 +424,7 @@ class ClaimViewSet(viewsets.ModelViewSet):
 class FinanceViewSet(viewsets.ModelViewSet):
     queryset = FinanceEntry.objects.filter(is_deleted=False)
     serializer_class = FinanceSerializer
-    permission_classes = [IsAuthenticated, CanViewFinance]
+    permission_classes = [*api_settings.DEFAULT_PERMISSION_CLASSES, CanViewFinance]
 
     def get_queryset(self):
         user = self.request.user
@@ -223,8 +438,100 @@ class FinanceViewSet(viewsets.ModelViewSet):
 
         return qs.none()
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(
+        instance = serializer.save(
             agency=self.request.user.agency,
             created_by=self.request.user
         )
+        webhooks.record("finance.created", instance, serializer.data)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        webhooks.record("finance.updated", instance, serializer.data)
+
+
+# ----------------------------------------------------------
+# WEBHOOKS (intégrations)
+# ----------------------------------------------------------
+
+class WebhookEndpointViewSet(viewsets.ModelViewSet):
+    queryset = WebhookEndpoint.objects.all()
+    serializer_class = WebhookEndpointSerializer
+
+    def get_queryset(self):
+        user = self.request.user
+
+        if user.role == "director":
+            return WebhookEndpoint.objects.filter(agency=user.agency)
+
+        return WebhookEndpoint.objects.none()
+
+    def perform_create(self, serializer):
+        serializer.save(agency=self.request.user.agency)
+
+    @action(detail=False, methods=["get"])
+    def metrics(self, request):
+        """Retard de l'outbox et des livraisons (toutes agences pour le superadmin)."""
+        user = request.user
+        if user.role == "superadmin":
+            return Response(webhooks.lag_metrics())
+        if user.role == "director":
+            return Response(webhooks.lag_metrics(user.agency_id))
+        return Response(status=403)
+
+
+# ----------------------------------------------------------
+# ANALYSE DES PRIX
+# ----------------------------------------------------------
+
+class PriceAnalyticsView(APIView):
+    """
+    Percentiles du prix au m² par type, opération et cellule (précalculés).
+    Filtres : ?property_type=&operation_type=&cell=
+    """
+
+    def get(self, request):
+        user = request.user
+        if user.role == "superadmin" or not user.agency_id:
+            return Response([])
+
+        qs = PriceStat.objects.filter(agency_id=user.agency_id, count__gt=0)
+        for param in ("property_type", "operation_type", "cell"):
+            value = request.query_params.get(param)
+            if value is not None:
+                qs = qs.filter(**{param: value})
+
+        qs = qs.order_by("property_type", "operation_type", "cell")
+        return Response(PriceStatSerializer(qs, many=True).data)
+
+
+# ----------------------------------------------------------
+# REQUÊTES GROUPÉES
+# ----------------------------------------------------------
+
+class BatchView(APIView):
+    """
+    Exécute plusieurs appels API en un aller-retour :
+    {"requests": [{"id": "p", "method": "GET", "path": "/api/properties/1/"}, ...],
+     "concurrent": true}
+    Réponse : [{"id", "status", "headers", "body"}, ...] dans le même ordre.
+    Coûte un jeton de débit par sous-requête, prélevé d'un coup.
+    """
+
+    def throttle_cost(self, request):
+        items = request.data.get("requests") if isinstance(request.data, dict) else None
+        return len(items) if isinstance(items, list) else 1
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = batch.run_batch(
+            request,
+            serializer.validated_data["requests"],
+            batch_view=BatchView,
+            concurrent=serializer.validated_data["concurrent"],
+        )
+        return Response(results)
@@ -0,0 +1,321 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import socket
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import urllib3
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import OutboxEvent, WebhookDelivery, WebhookEndpoint
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------
+# ÉCRITURE DANS L'OUTBOX
+# ----------------------------------------------------------
+
+def record(event_type, instance, payload, agency_id=None):
+    """
+    Ajoute un événement à l'outbox. À appeler dans la transaction qui
+    écrit `instance` : l'événement n'existe que si la donnée est validée.
+    """
+    agency_id = agency_id or instance.agency_id
+    if not agency_id:
+        return
+    OutboxEvent.objects.create(
+        agency_id=agency_id,
+        event_type=event_type,
+        model_label=instance._meta.label,
+        object_id=instance.pk,
+        payload=payload,
+    )
+
+
+# ----------------------------------------------------------
+# RÉPARTITION : OUTBOX -> LIVRAISONS
+# ----------------------------------------------------------
+
+def _coalesce(events):
+    """Un seul événement par (type, objet) : le plus récent l'emporte."""
+    latest = {}
+    for event in events:
+        latest[(event.agency_id, event.event_type, event.model_label, event.object_id)] = event
+    return sorted(latest.values(), key=lambda e: e.id)
+
+
+def _as_message(event):
+    return {
+        "id": event.id,
+        "type": event.event_type,
+        "object": event.model_label,
+        "object_id": event.object_id,
+        "created_at": event.created_at,
+        "data": event.payload,
+    }
+
+
+def drain_outbox(batch_size=None):
+    """
+    Vide un lot de l'outbox : coalesce, crée une livraison par endpoint
+    abonné (événements groupés) puis supprime les événements traités.
+    Retourne le nombre d'événements consommés.
+    """
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .order_by("id")[:batch_size]
+        )
+        if not events:
+            return 0
+
+        by_agency = {}
+        for event in _coalesce(events):
+            by_agency.setdefault(event.agency_id, []).append(event)
+
+        endpoints = WebhookEndpoint.objects.filter(agency_id__in=by_agency, is_active=True)
+        deliveries = []
+        for endpoint in endpoints:
+            messages = [
+                _as_message(e) for e in by_agency[endpoint.agency_id]
+                if not endpoint.events or e.event_type in endpoint.events
+            ]
+            if messages:
+                deliveries.append(WebhookDelivery(endpoint=endpoint, events=messages))
+
+        WebhookDelivery.objects.bulk_create(deliveries)
+        OutboxEvent.objects.filter(id__in=[e.id for e in events]).delete()
+
+    return len(events)
+
+
+# ----------------------------------------------------------
+# CONTRÔLE DES URL (SSRF)
+# ----------------------------------------------------------
+# Les URL sont fournies par les agences : sans contrôle, le worker
+# posterait des requêtes signées vers le réseau interne (redis, db,
+# métadonnées cloud 169.254.169.254...). Vérifié à l'enregistrement puis
+# à chaque envoi, sur l'adresse effectivement contactée.
+
+class UnsafeWebhookURL(ValueError):
+    pass
+
+
+class WebhookResolutionError(Exception):
+    """Échec DNS (souvent temporaire) : la livraison est retentée."""
+
+
+def resolve_url(url):
+    """
+    Retourne (schéma, hôte, port, chemin, adresse IP) si l'URL est en
+    https et que l'hôte ne résout que vers des adresses publiques ;
+    lève UnsafeWebhookURL sinon, WebhookResolutionError si le DNS ne
+    répond pas. WEBHOOK_ALLOW_PRIVATE_URLS (dev, tests) lève les deux
+    restrictions.
+    """
+    allow_private = getattr(settings, "WEBHOOK_ALLOW_PRIVATE_URLS", False)
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        raise UnsafeWebhookURL("URL invalide.")
+
+    if parts.scheme != "https" and not (allow_private and parts.scheme == "http"):
+        raise UnsafeWebhookURL("Seules les URL https sont acceptées.")
+    if not parts.hostname or parts.username or parts.password:
+        raise UnsafeWebhookURL("URL invalide.")
+
+    port = port or (443 if parts.scheme == "https" else 80)
+    try:
+        infos = socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    except UnicodeError:
+        raise UnsafeWebhookURL("URL invalide.")
+    except socket.gaierror as exc:
+        raise WebhookResolutionError(f"Hôte introuvable : {parts.hostname} ({exc})")
+
+    addresses = []
+    for info in infos:
+        ip = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if getattr(ip, "ipv4_mapped", None):
+            ip = ip.ipv4_mapped
+        # is_global exclut loopback, privé, lien local, partagé, réservé...
+        if not (ip.is_global or allow_private) or ip.is_multicast:
+            raise UnsafeWebhookURL(f"Adresse non publique refusée : {ip}")
+        addresses.append(str(ip))
+
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return parts.scheme, parts.hostname, port, path, addresses[0]
+
+
+# ----------------------------------------------------------
+# ENVOI HTTP
+# ----------------------------------------------------------
+
+_pool = None
+
+
+def get_pool():
+    """Pool de connexions HTTP partagé (keep-alive par hôte)."""
+    global _pool
+    if _pool is None:
+        _pool = urllib3.PoolManager(
+            num_pools=settings.WEBHOOK_POOL_HOSTS,
+            maxsize=settings.WEBHOOK_POOL_SIZE,
+            # `total` borne aussi un serveur qui répond octet par octet
+            timeout=urllib3.Timeout(
+                connect=settings.WEBHOOK_CONNECT_TIMEOUT,
+                read=settings.WEBHOOK_TIMEOUT,
+                total=settings.WEBHOOK_CONNECT_TIMEOUT + settings.WEBHOOK_TIMEOUT,
+            ),
+            retries=False,
+        )
+    return _pool
+
+
+def sign(secret, body):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _backoff(attempts):
+    delay = settings.WEBHOOK_BACKOFF_BASE * (2 ** (attempts - 1))
+    return timedelta(seconds=min(delay, settings.WEBHOOK_BACKOFF_MAX))
+
+
+def _send(delivery):
+    endpoint = delivery.endpoint
+    body = json.dumps({"events": delivery.events}, cls=DjangoJSONEncoder).encode()
+    headers = {
+        "Content-Type": "application/json",
+        "X-Avei-Delivery": str(delivery.id),
+    }
+    if endpoint.secret:
+        headers["X-Avei-Signature"] = f"sha256={sign(endpoint.secret, body)}"
+
+    # connexion à l'adresse vérifiée (pas de seconde résolution DNS) ;
+    # le nom d'hôte sert au SNI, au certificat et à l'en-tête Host
+    scheme, host, port, path, ip = resolve_url(endpoint.url)
+    default_port = 443 if scheme == "https" else 80
+    headers["Host"] = host if port == default_port else f"{host}:{port}"
+    pool_kwargs = {"server_hostname": host, "assert_hostname": host} if scheme == "https" else {}
+
+    pool = get_pool().connection_from_host(ip, port, scheme, pool_kwargs=pool_kwargs)
+    response = pool.urlopen("POST", path, body=body, headers=headers, redirect=False)
+    if not 200 <= response.status < 300:
+        raise urllib3.exceptions.HTTPError(f"HTTP {response.status}")
+
+
+def deliver_due(limit=None):
+    """
+    Envoie les livraisons échues ; retourne (réussies, échouées). Les envois
+    s'arrêtent après WEBHOOK_PASS_SECONDS, avant la fin du bail
+    (WEBHOOK_LEASE) : le reste est rendu et repris au passage suivant.
+    """
+    limit = limit or settings.WEBHOOK_BATCH_SIZE
+    now = timezone.now()
+    deadline = time.monotonic() + settings.WEBHOOK_PASS_SECONDS
+    ok = failed = 0
+
+    # Réservation courte (bail) : pas de transaction ouverte pendant les appels HTTP.
+    with transaction.atomic():
+        due = list(
+            WebhookDelivery.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("endpoint")
+            .filter(status="pending", next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:limit]
+        )
+        WebhookDelivery.objects.filter(id__in=[d.id for d in due]).update(
+            next_attempt_at=now + timedelta(seconds=settings.WEBHOOK_LEASE)
+        )
+
+    sent = []
+    for delivery in due:
+        if time.monotonic() >= deadline:
+            break
+        sent.append(delivery)
+        delivery.attempts += 1
+        try:
+            _send(delivery)
+        except UnsafeWebhookURL as exc:
+            failed += 1
+            delivery.status = "failed"
+            delivery.last_error = str(exc)[:1000]
+            logger.warning("Webhook %s refusé : %s", delivery.id, exc)
+        except (WebhookResolutionError, urllib3.exceptions.HTTPError) as exc:
+            failed += 1
+            delivery.last_error = str(exc)[:1000]
+            if delivery.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                delivery.status = "failed"
+                logger.warning("Webhook %s abandonné : %s", delivery.id, exc)
+            else:
+                delivery.next_attempt_at = timezone.now() + _backoff(delivery.attempts)
+        else:
+            ok += 1
+            delivery.status = "delivered"
+            delivery.delivered_at = timezone.now()
+            delivery.last_error = ""
+
+    WebhookDelivery.objects.bulk_update(
+        sent, ["status", "attempts", "next_attempt_at", "last_error", "delivered_at"]
+    )
+    WebhookDelivery.objects.filter(
+        id__in=[d.id for d in due[len(sent):]]
+    ).update(next_attempt_at=timezone.now())
+    return ok, failed
+
+
+def dispatch(max_rounds=20):
+    """Boucle du dispatcher : vide l'outbox puis envoie ce qui est échu."""
+    drained = 0
+    for _ in range(max_rounds):
+        count = drain_outbox()
+        drained += count
+        if not count:
+            break
+
+    ok, failed = deliver_due()
+
+    WebhookDelivery.objects.filter(
+        status="delivered",
+        delivered_at__lt=timezone.now() - timedelta(days=settings.WEBHOOK_RETENTION_DAYS),
+    ).delete()
+
+    return {"drained": drained, "delivered": ok, "failed": failed}
+
+
+# ----------------------------------------------------------
+# MÉTRIQUES DE RETARD
+# ----------------------------------------------------------
+
+def lag_metrics(agency_id=None):
+    now = timezone.now()
+    events = OutboxEvent.objects.all()
+    deliveries = WebhookDelivery.objects.filter(status="pending")
+    if agency_id:
+        events = events.filter(agency_id=agency_id)
+        deliveries = deliveries.filter(endpoint__agency_id=agency_id)
+
+    oldest_event = events.aggregate(t=Min("created_at"))["t"]
+    oldest_delivery = deliveries.aggregate(t=Min("created_at"))["t"]
+    failed = WebhookDelivery.objects.filter(status="failed")
+    if agency_id:
+        failed = failed.filter(endpoint__agency_id=agency_id)
+
+    return {
+        "outbox_pending": events.count(),
+        "outbox_lag_seconds": (now - oldest_event).total_seconds() if oldest_event else 0,
+        "deliveries_pending": deliveries.count(),
+        "delivery_lag_seconds": (now - oldest_delivery).total_seconds() if oldest_delivery else 0,
+        "deliveries_failed": failed.count(),
+    }